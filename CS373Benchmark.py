@@ -0,0 +1,381 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy
+
+# import our basic, light-weight png reader library
+import imageIO.png
+
+import CS373LicensePlateDetection as detection
+from CS373Instrumentation import StageRecorder
+
+'''
+Per-stage benchmark of the licence plate detection pipeline.
+
+Every image is run through the stages of main() repeat times, and the minimum and median seconds of
+every stage are written to a JSON file. With --compare the results are checked against a stored baseline
+file of the same form, and any stage slower than the baseline by more than the tolerance is reported
+as a regression (exit status 1).
+
+    python CS373Benchmark.py --output baseline.json
+    python CS373Benchmark.py --output current.json --compare baseline.json --tolerance 0.2
+
+Besides the sample images, synthetic images of 1, 4, 16 and 64 megapixels are made by upscaling
+numberplate1.png (nearest neighbour), so the results show how every stage scales with the image size.
+Interlaced (Adam7) re-encodes of numberplate1-6.png, and an interlaced palette re-encode of numberplate1.png,
+are written next to them and benchmarked as well, and before that checked to decode to the colours they were
+written with; a wrong decode is an error (exit status 1) like a regression.
+
+The start-up cost is measured in fresh interpreters: the import time of the detection module and of
+each module it imports (python -X importtime), and the wall time of a whole run on the smallest
+sample image without output. These are the 'startup' record of the results.
+'''
+
+SAMPLE_IMAGES = ["numberplate1.png", "numberplate2.png", "numberplate3.png", "numberplate4.png",
+                 "numberplate5.png", "numberplate6.png", "krakow.png"]
+SYNTHETIC_SOURCE_IMAGE = "numberplate1.png"
+SYNTHETIC_MEGAPIXELS = [1, 4, 16, 64]
+INTERLACED_SOURCE_IMAGES = ["numberplate1.png", "numberplate2.png", "numberplate3.png", "numberplate4.png",
+                            "numberplate5.png", "numberplate6.png"]
+INTERLACED_PALETTE_SOURCE_IMAGE = "numberplate1.png"
+STARTUP_MODULE = "CS373LicensePlateDetection"
+STARTUP_IMAGE = "numberplate5.png"
+
+# the stages in pipeline order. decode is the greyscale decode main() uses, first_row the time the same
+# decode takes to its first greyscale row, decode_threaded the decode with the decompression in a thread of
+# its own (--threaded-decode), decode_rgb, channel_split and greyscale are the separate RGB route of
+# readRGBImageToSeparatePixelArrays and getGreyScale. The stages after greyscale are the timings of detectLicencePlate
+STAGES = ["decode", "first_row", "decode_threaded", "decode_rgb", "channel_split", "greyscale", "stretch",
+          "standard_deviation_1", "standard_deviation_2", "threshold", "dilation", "erosion", "labeling", "bbox"]
+# the stages of other routes than main()'s, left out of the total
+ALTERNATIVE_STAGES = ("first_row", "decode_threaded", "decode_rgb", "channel_split", "greyscale")
+
+# run in a fresh interpreter by measureDecodeMemory: prints the peak resident set size after the imports
+# and after decoding the image argv[1] the way main() does. On Linux the peak is VmHWM of /proc/self/status,
+# ru_maxrss there is carried over from the parent process, the benchmark itself
+DECODE_MEMORY_SCRIPT = '''
+import sys
+import CS373LicensePlateDetection as detection
+
+def peakMemory():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+before = peakMemory()
+detection.readGreyscaleImageToPixelArray(sys.argv[1])
+print(before, peakMemory())
+'''
+
+
+# write a synthetic RGB png of about megapixels million pixels, numberplate1.png upscaled by nearest neighbour,
+# into synthetic_directory, unless it is there already. Returns the filename
+def createSyntheticImage(megapixels, synthetic_directory):
+    output_filename = Path(synthetic_directory) / "synthetic_{}mp.png".format(megapixels)
+    if output_filename.exists():
+        return str(output_filename)
+
+    image_reader = imageIO.png.Reader(filename=SYNTHETIC_SOURCE_IMAGE)
+    (image_width, image_height, image_rows, image_info) = image_reader.asRGB8()
+    rgb = detection.readPixelRowsToArray(image_rows, image_width, image_height, image_info)
+
+    scale = (megapixels * 1000000 / (image_width * image_height)) ** 0.5
+    new_width = round(image_width * scale)
+    new_height = round(image_height * scale)
+    source_rows = numpy.arange(new_height) * image_height // new_height
+    source_columns = numpy.arange(new_width) * image_width // new_width
+    upscaled = rgb[source_rows][:, source_columns]
+
+    Path(synthetic_directory).mkdir(parents=True, exist_ok=True)
+    detection.writePixelArrayToPNG(output_filename, upscaled)
+    return str(output_filename)
+
+
+# the colours of the RGB pixel array rgb reduced to a palette of 256, 3 bits of red and green and 2 of blue.
+# Returns the palette indices (image_height, image_width) and the palette, a list of (r, g, b)
+def quantizeToPalette(rgb):
+    indices = (rgb[:, :, 0] & 0xe0) | ((rgb[:, :, 1] & 0xe0) >> 3) | (rgb[:, :, 2] >> 6)
+    palette = [((index >> 5) * 255 // 7, ((index >> 2) & 7) * 255 // 7, (index & 3) * 255 // 3)
+               for index in range(256)]
+    return (indices, palette)
+
+
+# the RGB pixel array (image_height, image_width, 3) of input_filename, with palette=True reduced to the
+# palette of quantizeToPalette. Returns the pixel array and, with palette=True, the indices and the palette
+def readInterlacedSourceImage(input_filename, palette=False):
+    image = imageIO.png.Reader(filename=input_filename, mmap=True).read_image(direct=True)
+    rgb = numpy.asarray(image)[:, :, :3]
+    if not palette:
+        return (rgb, None, None)
+    (indices, palette_colours) = quantizeToPalette(rgb)
+    return (numpy.array(palette_colours, dtype=numpy.uint8)[indices], indices, palette_colours)
+
+
+# write input_filename re-encoded as an interlaced png, with palette=True as a palette image (see
+# quantizeToPalette), into synthetic_directory, unless it is there already. Returns the filename
+def createInterlacedImage(input_filename, synthetic_directory, palette=False):
+    output_filename = Path(synthetic_directory) / "{}_interlaced{}.png".format(
+        Path(input_filename).stem, "_palette" if palette else "")
+    if output_filename.exists():
+        return str(output_filename)
+
+    (rgb, indices, palette_colours) = readInterlacedSourceImage(input_filename, palette)
+    (image_height, image_width) = rgb.shape[:2]
+    if palette:
+        image_writer = imageIO.png.Writer(image_width, image_height, palette=palette_colours, interlace=True)
+        rows = indices.astype(numpy.uint8)
+    else:
+        image_writer = imageIO.png.Writer(image_width, image_height, greyscale=False, interlace=True)
+        rows = rgb.reshape(image_height, image_width * 3)
+    Path(synthetic_directory).mkdir(parents=True, exist_ok=True)
+    with open(output_filename, "wb") as output_file:
+        image_writer.write(output_file, (row.tobytes() for row in rows))
+    return str(output_filename)
+
+
+# check that the interlaced re-encode interlaced_filename of input_filename decodes to the colours it was
+# written with, and to the same greyscale image as they give. Returns a list of what differs, empty if nothing
+def checkInterlacedImage(interlaced_filename, input_filename, palette=False):
+    (rgb, indices, palette_colours) = readInterlacedSourceImage(input_filename, palette)
+    (image_height, image_width) = rgb.shape[:2]
+    mismatches = []
+    try:
+        image = imageIO.png.Reader(filename=interlaced_filename, mmap=True).read_image(direct=True)
+        if not numpy.array_equal(numpy.asarray(image)[:, :, :3], rgb):
+            mismatches.append("read_image(direct=True)")
+        (image_width, image_height, greyscale_pixel_array, colour_pixel_arrays) = \
+            detection.readGreyscaleImageToPixelArray(interlaced_filename)
+    except Exception as e:
+        # not only png errors, a decode that crashes is the regression to catch
+        return mismatches + ["decode: {}: {}".format(type(e).__name__, e)]
+    expected = detection.getGreyScale(rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2], image_width, image_height)
+    if not numpy.array_equal(greyscale_pixel_array, expected):
+        mismatches.append("readGreyscaleImageToPixelArray")
+    return mismatches
+
+
+# run every stage of the pipeline once on input_filename, returns the seconds of every stage
+def timeStages(input_filename):
+    recorder = StageRecorder()
+
+    with recorder.stage('decode'):
+        (image_width, image_height, greyscale_pixel_array, colour_pixel_arrays) = \
+            detection.readGreyscaleImageToPixelArray(input_filename)
+
+    with recorder.stage('first_row'):
+        (image_width, image_height, image_rows, image_info) = imageIO.png.Reader(
+            filename=input_filename, mmap=True).asLuminance8()
+        next(iter(image_rows))
+
+    with recorder.stage('decode_threaded'):
+        detection.readGreyscaleImageToPixelArray(input_filename, threaded=True)
+
+    with recorder.stage('decode_rgb'):
+        image = imageIO.png.Reader(filename=input_filename, mmap=True).read_image()
+
+    with recorder.stage('channel_split'):
+        (px_array_r, px_array_g, px_array_b) = detection.getColourChannelViews(image)
+
+    with recorder.stage('greyscale'):
+        detection.getGreyScale(px_array_r, px_array_g, px_array_b, image_width, image_height)
+
+    detection.detectLicencePlate(greyscale_pixel_array, image_width, image_height, recorder)
+    return (image_width, image_height, recorder.totals())
+
+
+# benchmark one image, repeat times. Returns the record written to the results file
+def benchmarkImage(input_filename, repeat):
+    runs = []
+    for i in range(repeat):
+        (image_width, image_height, timings) = timeStages(input_filename)
+        runs.append(timings)
+
+    stages = {}
+    for stage in STAGES:
+        seconds = [timings[stage] for timings in runs]
+        stages[stage] = {'min': min(seconds), 'median': statistics.median(seconds)}
+    totals = [sum(timings[stage] for stage in STAGES if stage not in ALTERNATIVE_STAGES) for timings in runs]
+    stages['total'] = {'min': min(totals), 'median': statistics.median(totals)}
+    return {'filename': input_filename, 'width': image_width, 'height': image_height, 'stages': stages,
+            'decode_peak_rss': measureDecodeMemory(input_filename)}
+
+
+# the growth of the peak resident set size in bytes while decoding input_filename, measured in a fresh
+# interpreter, since the peak of a process cannot be reset. None on Windows, which has no resource module
+def measureDecodeMemory(input_filename):
+    if sys.platform == "win32":
+        return None
+    completed = subprocess.run([sys.executable, "-c", DECODE_MEMORY_SCRIPT, str(Path(input_filename).resolve())],
+                               cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True)
+    (before, after) = (int(peak) for peak in completed.stdout.split())
+    # kilobytes, except for ru_maxrss on macOS, in bytes
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (after - before) * unit
+
+
+# import STARTUP_MODULE in a fresh interpreter with python -X importtime. Returns the cumulative import
+# seconds of the module, and of every module it imports itself, by module name
+def measureImportTime():
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + STARTUP_MODULE],
+                               cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True)
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package, indented two spaces per nesting level
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        (self_microseconds, cumulative_microseconds, module) = line[len("import time:"):].split("|")
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        if depth == 0 and module.strip() == STARTUP_MODULE:
+            import_times[STARTUP_MODULE] = int(cumulative_microseconds) / 1000000
+        elif depth == 1:
+            import_times[module.strip()] = int(cumulative_microseconds) / 1000000
+    return import_times
+
+
+# measure the start-up cost repeat times. Returns the record of the results file, with the stages
+# 'import' (all of STARTUP_MODULE), 'import <module>' for each module it imports that took a millisecond or more,
+# and 'run_small_image', a whole run of the detection on STARTUP_IMAGE without an output image
+def benchmarkStartup(repeat):
+    runs = []
+    for i in range(repeat):
+        import_times = measureImportTime()
+        timings = {'import': import_times.pop(STARTUP_MODULE)}
+        for module, seconds in sorted(import_times.items(), key=lambda item: -item[1]):
+            if seconds >= 0.001:
+                timings['import ' + module] = seconds
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, STARTUP_MODULE + ".py", str(Path(STARTUP_IMAGE).resolve()), "--no-output"],
+                       cwd=Path(__file__).resolve().parent, stdout=subprocess.DEVNULL, check=True)
+        timings['run_small_image'] = time.perf_counter() - start
+        runs.append(timings)
+
+    stages = {}
+    for stage in runs[0]:
+        seconds = [timings.get(stage, 0.0) for timings in runs]
+        stages[stage] = {'min': min(seconds), 'median': statistics.median(seconds)}
+    return {'module': STARTUP_MODULE, 'filename': STARTUP_IMAGE, 'stages': stages}
+
+
+# the records of a results file by name, the images and the start-up record if there is one
+def resultRecords(results):
+    records = dict(results['images'])
+    if 'startup' in results:
+        records['startup'] = results['startup']
+    return records
+
+
+# compare results against baseline, both in the form written by runBenchmarks. A stage regressed when its
+# minimum is more than tolerance (a fraction) slower than in the baseline and slower by at least min_seconds.
+# Prints a table of every stage found in both and returns the list of (image, stage) pairs that regressed
+def compareResults(results, baseline, tolerance, min_seconds):
+    regressions = []
+    baseline_records = resultRecords(baseline)
+    print("{:<24} {:<22} {:>10} {:>10} {:>8}".format("image", "stage", "baseline", "current", "change"))
+    for image, record in resultRecords(results).items():
+        if image not in baseline_records:
+            continue
+        baseline_stages = baseline_records[image]['stages']
+        for stage, seconds in record['stages'].items():
+            if stage not in baseline_stages:
+                continue
+            before = baseline_stages[stage]['min']
+            after = seconds['min']
+            change = (after - before) / before if before > 0 else 0.0
+            regressed = after > before * (1 + tolerance) and after - before >= min_seconds
+            if regressed:
+                regressions.append((image, stage))
+            print("{:<24} {:<22} {:>10.4f} {:>10.4f} {:>+7.1%}{}".format(
+                image, stage, before, after, change, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def runBenchmarks(command_line_arguments):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the licence plate detection.")
+    parser.add_argument("images", nargs="*", default=SAMPLE_IMAGES,
+                        help="png files to benchmark (default: numberplate1-6.png and krakow.png)")
+    parser.add_argument("--no-samples", action="store_true", help="only benchmark the synthetic images")
+    parser.add_argument("--megapixels", type=float, nargs="*", default=SYNTHETIC_MEGAPIXELS,
+                        help="sizes of the synthetic images in megapixels, no sizes to skip them (default: 1 4 16 64)")
+    parser.add_argument("--no-interlaced", action="store_true",
+                        help="skip the interlaced re-encodes and their decode check")
+    parser.add_argument("--synthetic-dir", default="benchmark_images",
+                        help="directory the synthetic images are written to and reused from")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs of every image (default: 3)")
+    parser.add_argument("--startup-repeat", type=int, default=5,
+                        help="fresh interpreters started to measure the start-up cost, 0 to skip it (default: 5)")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="results file")
+    parser.add_argument("--compare", metavar="BASELINE", default=None,
+                        help="results file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline as a fraction (default: 0.2)")
+    parser.add_argument("--min-seconds", type=float, default=0.01,
+                        help="smaller slowdowns are never regressions, they are timer noise (default: 0.01)")
+    arguments = parser.parse_args(command_line_arguments)
+
+    input_filenames = [] if arguments.no_samples else list(arguments.images)
+    for megapixels in arguments.megapixels:
+        # 1.0 and 1 name the same file
+        megapixels = int(megapixels) if megapixels == int(megapixels) else megapixels
+        input_filenames.append(createSyntheticImage(megapixels, arguments.synthetic_dir))
+
+    decode_errors = 0
+    interlaced_sources = [] if arguments.no_interlaced else (
+        [(source, False) for source in INTERLACED_SOURCE_IMAGES] + [(INTERLACED_PALETTE_SOURCE_IMAGE, True)])
+    for (source_filename, palette) in interlaced_sources:
+        interlaced_filename = createInterlacedImage(source_filename, arguments.synthetic_dir, palette)
+        mismatches = checkInterlacedImage(interlaced_filename, source_filename, palette)
+        for mismatch in mismatches:
+            print("DECODE MISMATCH {}: {}".format(Path(interlaced_filename).name, mismatch))
+        decode_errors += len(mismatches)
+        if not mismatches:
+            input_filenames.append(interlaced_filename)
+
+    results = {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'repeat': arguments.repeat,
+        'images': {},
+    }
+    for input_filename in input_filenames:
+        record = benchmarkImage(input_filename, arguments.repeat)
+        results['images'][Path(input_filename).name] = record
+        peak_rss = "-" if record['decode_peak_rss'] is None else "{:.1f} MiB".format(
+            record['decode_peak_rss'] / 2 ** 20)
+        print("{:<24} {:>5} x {:<5} total {:.3f}s, first row {:.4f}s, decode peak RSS {}".format(
+            Path(input_filename).name, record['width'], record['height'], record['stages']['total']['min'],
+            record['stages']['first_row']['min'], peak_rss), file=sys.stderr)
+
+    if arguments.startup_repeat > 0:
+        results['startup'] = benchmarkStartup(arguments.startup_repeat)
+        print("{:<24} import {:.3f}s, run {:.3f}s".format(
+            "startup", results['startup']['stages']['import']['min'],
+            results['startup']['stages']['run_small_image']['min']), file=sys.stderr)
+
+    with open(arguments.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    if arguments.compare is None:
+        return 1 if decode_errors else 0
+    with open(arguments.compare) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compareResults(results, baseline, arguments.tolerance, arguments.min_seconds)
+    print("{} regression(s) beyond {:.0%}".format(len(regressions), arguments.tolerance))
+    return 1 if regressions or decode_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(runBenchmarks(sys.argv[1:]))
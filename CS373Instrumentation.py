@@ -0,0 +1,173 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+'''
+Stage instrumentation for the licence plate detection pipeline and the png Reader.
+
+A StageRecorder records the wall time and CPU time of every stage, and with memory=True the peak
+of the memory allocated in the stage (tracemalloc, which slows down every allocation while it is on).
+If tracemalloc is off, the recorder turns it on when its first stage opens and off again when its last open
+stage ends, so it only slows down the stages it records.
+Stages are opened with
+
+    with recorder.stage('stretch'):
+        ...
+
+and may nest. The png Reader takes a recorder as well and records its own phases
+(chunk reading, decompress, unfilter) in the 'png' category. Stages nest within their thread, so the
+phases of the png Reader's threaded decoding show up on a track of their own in the trace (the memory
+peaks of stages overlapping in different threads are not told apart, tracemalloc has one peak).
+
+NULL_RECORDER records nothing, its stage() returns one shared do-nothing context manager,
+so instrumented code costs a method call per stage when recording is off.
+
+The recorded stages are written as trace-event JSON (writeChromeTrace), which loads into
+chrome://tracing or https://ui.perfetto.dev, or summed up per stage in a table (formatSummary).
+'''
+
+
+# a recorded stage: name, category, start (perf_counter seconds), wall and cpu seconds,
+# peak bytes allocated above the allocation at the start (None without memory recording) and thread id
+class StageEvent:
+    __slots__ = ('name', 'category', 'start', 'wall', 'cpu', 'peak_memory', 'thread')
+
+    def __init__(self, name, category, start, wall, cpu, peak_memory, thread):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.wall = wall
+        self.cpu = cpu
+        self.peak_memory = peak_memory
+        self.thread = thread
+
+
+class StageRecorder:
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self.origin = time.perf_counter()
+        # open stages with memory recording of every thread, innermost last:
+        # [current bytes at the start, peak bytes so far]
+        self.thread_memory = threading.local()
+        # stages with memory recording open in any thread, and whether this recorder started tracemalloc
+        self.memory_lock = threading.Lock()
+        self.open_stages = 0
+        self.started_tracing = False
+
+    # the context manager recording one stage
+    @contextlib.contextmanager
+    def stage(self, name, category='pipeline'):
+        if self.memory:
+            with self.memory_lock:
+                if self.open_stages == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self.started_tracing = True
+                self.open_stages += 1
+            if not hasattr(self.thread_memory, 'open_memory'):
+                self.thread_memory.open_memory = []
+            open_memory = self.thread_memory.open_memory
+            (current, peak) = tracemalloc.get_traced_memory()
+            # the peak so far belongs to the enclosing stages, before it is reset for this one
+            for memory in open_memory:
+                memory[1] = max(memory[1], peak)
+            tracemalloc.reset_peak()
+            open_memory.append([current, current])
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - start_cpu
+            peak_memory = None
+            if self.memory:
+                (start_memory, peak) = open_memory.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if open_memory:
+                    open_memory[-1][1] = max(open_memory[-1][1], peak)
+                peak_memory = peak - start_memory
+                with self.memory_lock:
+                    self.open_stages -= 1
+                    if self.open_stages == 0 and self.started_tracing:
+                        self.started_tracing = False
+                        if tracemalloc.is_tracing():
+                            tracemalloc.stop()
+            self.events.append(StageEvent(name, category, start, wall, cpu, peak_memory, threading.get_ident()))
+
+    # wall seconds summed up per stage name, in the order the stages first ended
+    def totals(self, category='pipeline'):
+        totals = {}
+        for event in self.events:
+            if event.category == category:
+                totals[event.name] = totals.get(event.name, 0.0) + event.wall
+        return totals
+
+    # count, wall and cpu seconds summed up per (category, stage name), and the largest peak memory
+    def summary(self):
+        summary = {}
+        for event in self.events:
+            key = (event.category, event.name)
+            if key not in summary:
+                summary[key] = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_memory': None}
+            entry = summary[key]
+            entry['count'] += 1
+            entry['wall'] += event.wall
+            entry['cpu'] += event.cpu
+            if event.peak_memory is not None:
+                entry['peak_memory'] = max(entry['peak_memory'] or 0, event.peak_memory)
+        return summary
+
+    # the summary as a plain text table
+    def formatSummary(self):
+        lines = ["{:<10} {:<22} {:>7} {:>10} {:>10} {:>12}".format(
+            "category", "stage", "count", "wall s", "cpu s", "peak MiB")]
+        for (category, name), entry in self.summary().items():
+            peak = "-" if entry['peak_memory'] is None else "{:.1f}".format(entry['peak_memory'] / 2 ** 20)
+            lines.append("{:<10} {:<22} {:>7} {:>10.4f} {:>10.4f} {:>12}".format(
+                category, name, entry['count'], entry['wall'], entry['cpu'], peak))
+        return "\n".join(lines)
+
+    # the stages as a list of trace events ('X', complete events with a duration), times in microseconds
+    def traceEvents(self):
+        trace_events = []
+        for event in self.events:
+            arguments = {'cpu_ms': event.cpu * 1000}
+            if event.peak_memory is not None:
+                arguments['peak_memory_bytes'] = event.peak_memory
+            trace_events.append({
+                'name': event.name,
+                'cat': event.category,
+                'ph': 'X',
+                'ts': (event.start - self.origin) * 1000000,
+                'dur': event.wall * 1000000,
+                'pid': os.getpid(),
+                'tid': event.thread,
+                'args': arguments,
+            })
+        return trace_events
+
+    # write the stages into output_filename as trace-event JSON for chrome://tracing or Perfetto
+    def writeChromeTrace(self, output_filename):
+        with open(output_filename, "w") as output_file:
+            json.dump({'traceEvents': self.traceEvents(), 'displayTimeUnit': 'ms'}, output_file)
+
+
+# a recorder that records nothing
+class NullRecorder:
+
+    def __init__(self):
+        self.no_stage = contextlib.nullcontext()
+
+    def stage(self, name, category='pipeline'):
+        return self.no_stage
+
+    def totals(self, category='pipeline'):
+        return {}
+
+
+NULL_RECORDER = NullRecorder()
@@ -1,363 +1,1239 @@
-import math
+import argparse
+import glob
+import json
+import operator
+import os
 import sys
 from pathlib import Path
 
-from matplotlib import pyplot
-from matplotlib.patches import Rectangle
+import numpy
 
 # import our basic, light-weight png reader library
 import imageIO.png
 
+from CS373Instrumentation import NULL_RECORDER, StageRecorder
+
 '''
-A licence plate detection program using adaptive thresholding,  
+A licence plate detection program using adaptive thresholding,
 the step 'get high contrast region by computing standard deviation' is done twice to get more accurate results
+
+Pixel arrays are contiguous numpy arrays of shape (image_height, image_width), so every stage
+below works on whole rows / whole images at once instead of looping over lists of lists.
+Greyscale images are uint8 (uint16 for 16 bit input), binary masks are uint8 (0/1 or 0/255)
+and label images are uint32.
 '''
 
-# this function reads an RGB color png file and returns width, height, as well as pixel arrays for r,g,b
+# default size of the flat rectangular structuring element used to close the thresholded image,
+# the same as 7 iterations of the 3 x 3 dilation and erosion (--closing-width, --closing-height)
+CLOSING_SE_WIDTH = 15
+CLOSING_SE_HEIGHT = 15
+# the ways to close the thresholded image, all with the same result (--closing-engine): shifts of the bit-packed
+# mask, running extremes of the unpacked mask (van Herk / Gil-Werman) or chessboard distance transforms, which
+# only take square structuring elements and cost the same for any size
+CLOSING_ENGINES = ('packed', 'rectangular', 'distance')
+
+# rows of the image converted to greyscale at a time from the r, g, b pixel arrays
+GREYSCALE_BAND_HEIGHT = 16
+
+# colour and thickness in pixels of the bounding box drawn into output images
+BOUNDING_BOX_COLOUR = (0, 255, 0)
+BOUNDING_BOX_LINE_WIDTH = 2
+
+
+# this function reads an RGB color png file and returns width, height, as well as pixel arrays for r,g,b.
+# The png reader decodes the image into one buffer, and the pixel arrays are views of it, nothing is copied.
+# Any png colour type is read as 8 bit: palettes are expanded, greyscale gives equal r, g, b and alpha is ignored
 def readRGBImageToSeparatePixelArrays(input_filename):
-    image_reader = imageIO.png.Reader(filename=input_filename)
-    # png reader gives us width and height, as well as RGB data in image_rows (a list of rows of RGB triplets)
-    (image_width, image_height, rgb_image_rows, rgb_image_info) = image_reader.read()
+    image = imageIO.png.Reader(filename=input_filename, mmap=True).read_image(direct=True)
 
-    print("read image width={}, height={}".format(image_width, image_height))
+    print("read image width={}, height={}".format(image.width, image.height))
 
-    # our pixel arrays are lists of lists, where each inner list stores one row of greyscale pixels
-    pixel_array_r = []
-    pixel_array_g = []
-    pixel_array_b = []
-
-    for row in rgb_image_rows:
-        pixel_row_r = []
-        pixel_row_g = []
-        pixel_row_b = []
-        r = 0
-        g = 0
-        b = 0
-        for elem in range(len(row)):
-            # RGB triplets are stored consecutively in image_rows
-            if elem % 3 == 0:
-                r = row[elem]
-            elif elem % 3 == 1:
-                g = row[elem]
-            else:
-                b = row[elem]
-                pixel_row_r.append(r)
-                pixel_row_g.append(g)
-                pixel_row_b.append(b)
+    (pixel_array_r, pixel_array_g, pixel_array_b) = getColourChannelViews(image)
+
+    return (image.width, image.height, pixel_array_r, pixel_array_g, pixel_array_b)
+
+
+# copy the rows of a png reader into one (image_height, image_width, planes) pixel array.
+# Each row is a bytearray (or array('H') for 16 bit images)
+def readPixelRowsToArray(image_rows, image_width, image_height, image_info):
+    dtype = numpy.uint8 if image_info['bitdepth'] <= 8 else numpy.uint16
+    planes = image_info['planes']
+    pixel_array = numpy.empty((image_height, image_width * planes), dtype=dtype)
+    for r, row in enumerate(image_rows):
+        pixel_array[r] = numpy.frombuffer(row, dtype=dtype)
+    return pixel_array.reshape(image_height, image_width, planes)
 
-        pixel_array_r.append(pixel_row_r)
-        pixel_array_g.append(pixel_row_g)
-        pixel_array_b.append(pixel_row_b)
 
-    return (image_width, image_height, pixel_array_r, pixel_array_g, pixel_array_b)
+# RGB triplets are stored consecutively in the buffer of a decoded png image (imageIO.png.DecodedImage),
+# return the r, g, b channels as (image_height, image_width) pixel arrays that are strided views of the buffer.
+# A greyscale image gives its one channel three times
+def getColourChannelViews(image):
+    planes = [0, 1, 2] if image.planes >= 3 else [0, 0, 0]
+    return tuple(numpy.asarray(image.channel(plane)).reshape(image.height, image.width) for plane in planes)
 
 
-# a useful shortcut method to create a list of lists based array representation for an image, initialized with a value
-def createInitializedGreyscalePixelArray(image_width, image_height, initValue=0):
-    new_array = [[initValue for x in range(image_width)] for y in range(image_height)]
+# this function reads a png file and returns width, height and the greyscale pixel array,
+# converting every row to greyscale as soon as it is decoded. With colour_planes True the image is decoded
+# into one buffer instead (see readRGBImageToSeparatePixelArrays), the r, g, b pixel arrays returned are strided
+# views of it and the greyscale pixel array is computed from them, GREYSCALE_BAND_HEIGHT rows at a time
+# (otherwise None is returned for them).
+# recorder, if given, records the phases of the png reader. The file is memory-mapped and its chunks parsed
+# in place, and with check_crc=False the chunk checksums are not verified, for trusted files.
+# With threaded=True the image data is decompressed in a thread of its own, overlapped with the unfiltering
+def readGreyscaleImageToPixelArray(input_filename, colour_planes=False, recorder=None, check_crc=True,
+                                   threaded=False):
+    image_reader = imageIO.png.Reader(filename=input_filename, recorder=recorder, mmap=True, check_crc=check_crc,
+                                      threaded=threaded)
+    if colour_planes:
+        image = image_reader.read_image(direct=True)
+        (pixel_array_r, pixel_array_g, pixel_array_b) = getColourChannelViews(image)
+        if image.planes < 3:
+            return (image.width, image.height, pixel_array_r.copy(), (pixel_array_r, pixel_array_g, pixel_array_b))
+        # band by band, so the floating point intermediates of getGreyScale stay small
+        greyscale_pixel_array = createInitializedGreyscalePixelArray(image.width, image.height)
+        for (start, end) in computeBands(image.height, GREYSCALE_BAND_HEIGHT):
+            greyscale_pixel_array[start:end] = getGreyScale(pixel_array_r[start:end], pixel_array_g[start:end],
+                                                            pixel_array_b[start:end], image.width, end - start)
+        return (image.width, image.height, greyscale_pixel_array, (pixel_array_r, pixel_array_g, pixel_array_b))
+
+    (image_width, image_height, image_rows, image_info) = image_reader.asLuminance8()
+    greyscale_pixel_array = createInitializedGreyscalePixelArray(image_width, image_height)
+    for r, row in enumerate(image_rows):
+        greyscale_pixel_array[r] = numpy.frombuffer(row, dtype=numpy.uint8)
+    return (image_width, image_height, greyscale_pixel_array, None)
+
+
+# a useful shortcut method to create an array representation for an image, initialized with a value
+def createInitializedGreyscalePixelArray(image_width, image_height, initValue=0, dtype=numpy.uint8):
+    new_array = numpy.full((image_height, image_width), initValue, dtype=dtype)
     return new_array
 
 
 # Compute greyscale from RGB
 def getGreyScale(px_array_r, px_array_g, px_array_b, image_width, image_height):
-    greyscale_pixel_array = createInitializedGreyscalePixelArray(image_width, image_height)
-    for r in range(image_height):
-        for c in range(image_width):
-            greyvalue = px_array_r[r][c] * 0.299 + px_array_g[r][c] * 0.587
-            greyvalue = round(greyvalue + px_array_b[r][c] * 0.114)
-            greyscale_pixel_array[r][c] = greyvalue
+    # same evaluation order as r * 0.299 + g * 0.587 + b * 0.114 per pixel, so the rounding is identical
+    greyvalue = px_array_r * 0.299 + px_array_g * 0.587
+    greyvalue = numpy.round(greyvalue + px_array_b * 0.114)
+    greyscale_pixel_array = greyvalue.astype(px_array_r.dtype)
     return greyscale_pixel_array
 
 
 # Stretch to 0 - 255
 def stretch(anArray, image_height, image_width):
-    stretched_array = createInitializedGreyscalePixelArray(image_width, image_height)
-    maximum = minimum = anArray[0][0]
-    for r in range(image_height):
-        for c in range(image_width):
-            if anArray[r][c] > maximum:
-                maximum = anArray[r][c]
-            elif anArray[r][c] < minimum:
-                minimum = anArray[r][c]
-
-    if maximum != minimum:
-        a = 255 / (maximum - minimum)
-        for r in range(image_height):
-            for c in range(image_width):
-                stretched_array[r][c] = round((anArray[r][c] - minimum) * a)
+    maximum = int(anArray.max())
+    minimum = int(anArray.min())
+    return stretchRange(anArray, minimum, maximum)
+
+
+# Stretch from minimum - maximum to 0 - 255. With the minimum and maximum of a whole image,
+# every band of rows of the image is stretched the same as in the whole image
+def stretchRange(anArray, minimum, maximum):
+    if maximum == minimum:
+        return numpy.zeros(anArray.shape, dtype=numpy.uint8)
+    a = 255 / (maximum - minimum)
+    stretched_array = numpy.round((anArray - minimum) * a).astype(numpy.uint8)
     return stretched_array
 
 
-# computer standard deviation (5 x 5)
-def getStandardDeviation(stretched_array, image_width, image_height):
+# the largest window_size of getStandardDeviation: the sums of squares of its windows still fit in int32,
+# and the final combine of the window sums in int64
+MAX_STANDARD_DEVIATION_WINDOW = 181
+
+
+# the narrowest of uint16 and int32 that holds every value from 0 to maximum
+def getSumType(maximum):
+    return numpy.uint16 if maximum <= numpy.iinfo(numpy.uint16).max else numpy.int32
+
+
+# sums of every run of length consecutive entries of values along axis, as dtype, one entry per run position
+# (the axis gets length - 1 entries shorter). The sums of the runs of 1, 2, 4, ... entries are doubled up from
+# each other and added together by the binary digits of length, so a run costs about log2(length) additions
+def computeRunningSums(values, length, axis, dtype):
+    def part(start, stop):
+        return (slice(None),) * axis + (slice(start, stop),)
+
+    power = numpy.asarray(values, dtype=dtype)
+    power_length = 1
+    runs = None
+    runs_length = 0
+    while True:
+        if length & power_length:
+            if runs is None:
+                runs = power
+            else:
+                runs = runs[part(None, runs.shape[axis] - power_length)] + power[part(runs_length, None)]
+            runs_length += power_length
+        if power_length * 2 > length:
+            return runs
+        power = power[part(None, -power_length)] + power[part(power_length, None)]
+        power_length *= 2
+
+
+# the pixels per strip of rows of getStandardDeviation, few enough that the window sums of a strip stay in the
+# CPU cache
+STANDARD_DEVIATION_STRIP_PIXELS = 1 << 16
+
+
+# the standard deviation of every window_size x window_size window that lies completely inside pixel_array,
+# as in getStandardDeviation, one entry per window position
+def computeWindowStandardDeviation(pixel_array, window_size, deviation_width):
+    (image_height, image_width) = pixel_array.shape
+    n = window_size * window_size
+    k = deviation_width * window_size
+    column_sum = computeRunningSums(pixel_array, window_size, 0, getSumType(255 * window_size))
+    column_square_sum = computeRunningSums(numpy.multiply(pixel_array, pixel_array, dtype=numpy.int32),
+                                           window_size, 0, numpy.int32)
+
+    # align the narrower deviation windows with the centres of the full windows
+    offset = (window_size - deviation_width) // 2
+    columns = slice(offset, offset + image_width - window_size + deviation_width)
+    window_sum = computeRunningSums(column_sum, window_size, 1, getSumType(255 * n))
+    deviation_sum = computeRunningSums(column_sum[:, columns], deviation_width, 1, getSumType(255 * k))
+    deviation_square_sum = computeRunningSums(column_square_sum[:, columns], deviation_width, 1, numpy.int32)
+
+    # with mean = window_sum / n:
+    # sum((x - mean)^2) / n = (n^2 * sum(x^2) - 2 * n * window_sum * sum(x) + k * window_sum^2) / n^3,
+    # where every term and partial sum is below 2 * n^2 * k * 255^2
+    combine_type = numpy.int32 if 2 * n * n * k * 255 * 255 <= numpy.iinfo(numpy.int32).max else numpy.int64
+    numerator = deviation_square_sum.astype(combine_type)
+    numerator *= n * n
+    term = numpy.multiply(window_sum, deviation_sum, dtype=combine_type)
+    term *= 2 * n
+    numerator -= term
+    numpy.multiply(window_sum, window_sum, out=term, dtype=combine_type)
+    term *= k
+    numerator += term
+    numerator //= n * n * n
+    # the floor of the float32 square root, which is exact for integers up to 255^2
+    return numpy.sqrt(numerator, dtype=numpy.float32).astype(numpy.uint8)
+
+
+# compute standard deviation over a window_size x window_size window (5 x 5 by default).
+# The mean is taken over the whole window, the squared deviations are summed over the centre
+# deviation_width columns of the window and divided by the window area, as the detection was tuned with;
+# pass deviation_width=window_size for the plain standard deviation.
+# The window sums of the values and of the squared values are exact integers, summed once down the columns
+# and then along the rows with computeRunningSums, for any window_size up to MAX_STANDARD_DEVIATION_WINDOW.
+# Each sum is kept in the narrowest of uint16 and int32 that holds it, and only the final combine is widened,
+# to int64 when it could overflow int32. The image is worked through in strips of rows of about
+# STANDARD_DEVIATION_STRIP_PIXELS, each with the window_size - 1 rows it needs below it.
+# Pixels closer than window_size // 2 to the border are 0.
+def getStandardDeviation(stretched_array, image_width, image_height, window_size=5, deviation_width=3):
+    if window_size % 2 == 0 or deviation_width % 2 == 0 or deviation_width > window_size:
+        raise ValueError("window_size and deviation_width must be odd, with deviation_width <= window_size")
+    if window_size > MAX_STANDARD_DEVIATION_WINDOW:
+        raise ValueError("window_size must be at most {}".format(MAX_STANDARD_DEVIATION_WINDOW))
     sd_array = createInitializedGreyscalePixelArray(image_width, image_height, 0)
-    for r in range(2, image_height - 2):
-        for c in range(2, image_width - 2):
-            avg = stretched_array[r - 2][c - 2] + stretched_array[r - 2][c - 1] + stretched_array[r - 2][c] + \
-                  stretched_array[r - 2][c + 1] + stretched_array[r - 2][c + 2]
-            avg += stretched_array[r - 1][c - 2] + stretched_array[r - 1][c - 1] + stretched_array[r - 1][c] + \
-                   stretched_array[r - 1][c + 1] + stretched_array[r - 1][c + 2]
-            avg += stretched_array[r][c - 2] + stretched_array[r][c - 1] + stretched_array[r][c] + stretched_array[r][
-                c + 1] + stretched_array[r][c + 2]
-            avg += stretched_array[r + 1][c - 2] + stretched_array[r + 1][c - 1] + stretched_array[r + 1][c] + \
-                   stretched_array[r + 1][c + 1] + stretched_array[r + 1][c + 2]
-            avg += stretched_array[r + 2][c - 2] + stretched_array[r + 2][c - 1] + stretched_array[r + 2][c] + \
-                   stretched_array[r + 2][c + 1] + stretched_array[r + 2][c + 2]
-            avg = avg / 25
-
-            temp = pow(stretched_array[r - 2][c - 1] - avg, 2)
-            temp += pow(stretched_array[r - 2][c] - avg, 2) + pow(stretched_array[r - 2][c + 1] - avg, 2)
-            temp += pow(stretched_array[r - 1][c - 1] - avg, 2) + pow(stretched_array[r - 1][c] - avg, 2)
-            temp += pow(stretched_array[r - 1][c + 1] - avg, 2) + pow(stretched_array[r][c - 1] - avg, 2)
-            temp += pow(stretched_array[r][c] - avg, 2) + pow(stretched_array[r][c + 1] - avg, 2)
-            temp += pow(stretched_array[r + 1][c - 1] - avg, 2) + pow(stretched_array[r + 1][c] - avg, 2)
-            temp += pow(stretched_array[r + 1][c + 1] - avg, 2) + pow(stretched_array[r + 2][c - 1] - avg, 2)
-            temp += pow(stretched_array[r + 2][c] - avg, 2) + pow(stretched_array[r + 2][c + 1] - avg, 2)
-            temp = temp / 25
-            sd_array[r][c] = int(math.sqrt(temp))
+    border = window_size // 2
+    if image_width < window_size or image_height < window_size:
+        return sd_array
+
+    strip_height = max(1, STANDARD_DEVIATION_STRIP_PIXELS // image_width)
+    for (start, end) in computeBands(image_height - 2 * border, strip_height):
+        sd_array[border + start:border + end, border:image_width - border] = computeWindowStandardDeviation(
+            stretched_array[start:end + 2 * border], window_size, deviation_width)
     return sd_array
 
 
 # compute image by threshold to get high contrast area
 def getThresholdArray(anArray, image_width, image_height, threshold):
-    threshold_array = createInitializedGreyscalePixelArray(image_width, image_height, 0.0)
-    for r in range(image_height):
-        for c in range(image_width):
-            if anArray[r][c] < threshold:
-                threshold_array[r][c] = 0
-            else:
-                threshold_array[r][c] = 255
+    threshold_array = numpy.where(anArray < threshold, 0, 255).astype(numpy.uint8)
     return threshold_array
 
 
 # get non-cumulative histogram from input image (255 bins)
 def computeHistogram(pixel_array, image_width, image_height):
-    histogram = [0.0 for i in range(256)]
-    for r in range(image_height):
-        for c in range(image_width):
-            histogram[pixel_array[r][c] - 1] += 1
+    counts = numpy.bincount(pixel_array.ravel(), minlength=256)[:256]
+    # value v is counted in bin v - 1, so value 0 wraps around to the last bin
+    histogram = numpy.roll(counts, -1).astype(numpy.float64)
     return histogram
 
 
 # EXTENSION: calculate adaptive threshold from input image
 def getThreshold(anArray, image_height, image_width):
-    Hq = computeHistogram(anArray, image_width, image_height)
-    qHq = [0.0 for x in range(len(Hq))]
+    return getThresholdFromHistogram(computeHistogram(anArray, image_width, image_height))
+
+
+# the adaptive threshold of an image with histogram Hq (of computeHistogram). The histograms of
+# the bands of an image add up to the histogram of the whole image
+def getThresholdFromHistogram(Hq):
+    qHq = numpy.arange(len(Hq)) * Hq
     previous = 0
-    for x in range(len(Hq)):
-        qHq[x] = x * Hq[x]
-    threshold = int(math.ceil(sum(qHq) / sum(Hq)))
+    threshold = int(numpy.ceil(qHq.sum() / Hq.sum()))
     while threshold != previous:
         previous = threshold
-        objects = background = NumObjects = NumBackground = 0
-        for obj in range(previous):
-            NumObjects += Hq[obj]
-            objects += qHq[obj]
-        for bg in range(previous, len(Hq)):
-            NumBackground += Hq[bg]
-            background += qHq[bg]
-        threshold = int(math.ceil((objects / NumObjects + background / NumBackground) / 2))
+        NumObjects = Hq[:previous].sum()
+        objects = qHq[:previous].sum()
+        NumBackground = Hq[previous:].sum()
+        background = qHq[previous:].sum()
+        threshold = int(numpy.ceil((objects / NumObjects + background / NumBackground) / 2))
     return threshold
 
 
 # 3x3 dilation
 def computeDilation8Nbh3x3FlatSE(pixel_array, image_width, image_height):
-    result = createInitializedGreyscalePixelArray(image_width, image_height)
-    padding = createInitializedGreyscalePixelArray(image_width + 2, image_height + 2)
-    for r in range(image_height):
-        for c in range(image_width):
-            padding[r + 1][c + 1] = pixel_array[r][c]
-    for r in range(image_height):
-        for c in range(image_width):
-            result[r][c] = 1
-            if padding[r][c] == 0 and padding[r + 1][c] == 0 and padding[r + 2][c] == 0:
-                if padding[r][c + 1] == 0 and padding[r + 1][c + 1] == 0 and padding[r + 2][c + 1] == 0:
-                    if padding[r][c + 2] == 0 and padding[r + 1][c + 2] == 0 and padding[r + 2][c + 2] == 0:
-                        result[r][c] = 0
-    return result
+    padding = numpy.zeros((image_height + 2, image_width + 2), dtype=bool)
+    padding[1:image_height + 1, 1:image_width + 1] = pixel_array != 0
+    result = numpy.zeros((image_height, image_width), dtype=bool)
+    for dr in range(3):
+        for dc in range(3):
+            result |= padding[dr:dr + image_height, dc:dc + image_width]
+    return result.astype(numpy.uint8)
 
 
 # 3x3 erosion
 def computeErosion8Nbh3x3FlatSE(pixel_array, image_width, image_height):
     result = createInitializedGreyscalePixelArray(image_width, image_height)
-    for r in range(1, image_height - 1):
-        for c in range(1, image_width - 1):
-            if pixel_array[r][c] != 0 and pixel_array[r - 1][c] != 0 and pixel_array[r + 1][c] != 0:
-                if pixel_array[r][c - 1] != 0 and pixel_array[r - 1][c - 1] != 0 and pixel_array[r + 1][c - 1] != 0:
-                    if pixel_array[r][c + 1] != 0 and pixel_array[r - 1][c + 1] != 0 and pixel_array[r + 1][c + 1] != 0:
-                        result[r][c] = 1
+    if image_width < 3 or image_height < 3:
+        return result
+    foreground = pixel_array != 0
+    inner = numpy.ones((image_height - 2, image_width - 2), dtype=bool)
+    for dr in range(3):
+        for dc in range(3):
+            inner &= foreground[dr:dr + image_height - 2, dc:dc + image_width - 2]
+    # border pixels are never set, as in the unpadded 3x3 window
+    result[1:image_height - 1, 1:image_width - 1] = inner
     return result
 
 
-# get connected components
-def computeConnectedComponentLabeling(pixel_array, image_width, image_height):
-    result = createInitializedGreyscalePixelArray(image_width, image_height)
-    components = {}
-    visited = {}
-    count = 1
+# running maximum or minimum (function is numpy.maximum or numpy.minimum) over a window of window_size pixels
+# centred on every pixel of each row, with pixels outside the image counting as 0.
+# van Herk / Gil-Werman: the padded row is cut into blocks of window_size pixels, and every window covers the
+# end of one block and the start of the next, so it is combined from one suffix and one prefix extreme.
+# This costs 3 operations per pixel for any window size
+def computeRunningExtreme(pixel_array, window_size, function):
+    (height, width) = pixel_array.shape
+    half = window_size // 2
+    blocks = -(-(width + window_size - 1) // window_size)
+    padded = numpy.zeros((height, blocks * window_size), dtype=pixel_array.dtype)
+    padded[:, half:half + width] = pixel_array
+    padded = padded.reshape(height, blocks, window_size)
+    prefix = function.accumulate(padded, axis=2).reshape(height, -1)
+    suffix = function.accumulate(padded[:, :, ::-1], axis=2)[:, :, ::-1].reshape(height, -1)
+    # the window of pixel x covers padded columns x .. x + window_size - 1
+    return function(suffix[:, :width], prefix[:, window_size - 1:window_size - 1 + width])
+
+
+# running extreme over a se_width x se_height rectangle, done as one pass along the rows and one along the columns
+def computeRectangularExtreme(pixel_array, se_width, se_height, function):
+    if se_width < 1 or se_height < 1 or se_width % 2 == 0 or se_height % 2 == 0:
+        raise ValueError("structuring element width and height must be odd and positive")
+    result = pixel_array
+    if se_width > 1:
+        result = computeRunningExtreme(result, se_width, function)
+    if se_height > 1:
+        result = computeRunningExtreme(result.T, se_height, function).T
+    return numpy.ascontiguousarray(result)
+
+
+# dilation with a se_width x se_height flat rectangular structuring element (both odd),
+# for example 15 x 15 gives the same result as 7 times computeDilation8Nbh3x3FlatSE
+def computeDilationRectangularFlatSE(pixel_array, image_width, image_height, se_width, se_height):
+    foreground = (pixel_array != 0).astype(numpy.uint8)
+    return computeRectangularExtreme(foreground, se_width, se_height, numpy.maximum)
+
+
+# erosion with a se_width x se_height flat rectangular structuring element (both odd). Pixels outside the image
+# are background, so pixels closer than se_width // 2 or se_height // 2 to the border become 0,
+# for example 15 x 15 gives the same result as 7 times computeErosion8Nbh3x3FlatSE
+def computeErosionRectangularFlatSE(pixel_array, image_width, image_height, se_width, se_height):
+    foreground = (pixel_array != 0).astype(numpy.uint8)
+    return computeRectangularExtreme(foreground, se_width, se_height, numpy.minimum)
+
+
+# closing (dilation followed by erosion) with a se_width x se_height flat rectangular structuring element
+def computeClosingRectangularFlatSE(pixel_array, image_width, image_height, se_width, se_height):
+    dilated_array = computeDilationRectangularFlatSE(pixel_array, image_width, image_height, se_width, se_height)
+    return computeErosionRectangularFlatSE(dilated_array, image_width, image_height, se_width, se_height)
+
+
+# chessboard distance from every pixel to the nearest nonzero pixel of pixel_array (0 on those pixels),
+# by the two pass raster scan: the forward pass takes the neighbours above and to the left, the backward pass
+# the neighbours below and to the right. Each row is updated at once, the left to right dependency is the
+# running minimum of distance - column, plus column. Pixels without any nonzero pixel keep
+# image_width + image_height
+def computeChessboardDistanceTransform(pixel_array, image_width, image_height):
+    far = image_width + image_height
+    distance = numpy.where(pixel_array != 0, 0, far).astype(numpy.int32)
+    columns = numpy.arange(image_width, dtype=numpy.int32)
+    outside_row = numpy.full(image_width, far, dtype=numpy.int32)
+    # the row scanned before, padded so every column has a left and right neighbour
+    neighbours = numpy.full(image_width + 2, far, dtype=numpy.int32)
+
+    def scanRow(row, previous_row, right_to_left):
+        neighbours[1:image_width + 1] = previous_row
+        nearest = numpy.minimum(numpy.minimum(neighbours[:-2], neighbours[1:-1]), neighbours[2:]) + 1
+        numpy.minimum(row, nearest, out=row)
+        ordered = row[::-1] if right_to_left else row
+        ordered[:] = numpy.minimum.accumulate(ordered - columns) + columns
+
     for r in range(image_height):
-        for c in range(image_width):
-            if pixel_array[r][c] != 0 and (r not in visited or c not in visited[r]):
-                queue = []
-                queue.append((r, c))
-                components[count] = 0
-                if r in visited:
-                    visited[r].append(c)
-                else:
-                    visited[r] = [c]
-                while len(queue) != 0:
-                    (c1, c2) = queue.pop(0)
-                    result[c1][c2] = count
-                    components[count] += 1
-
-                    if c1 not in visited:
-                        if c2 > 0 and pixel_array[c1][c2 - 1] != 0:
-                            queue.append((c1, c2 - 1))
-                            visited[c1] = [c2 - 1]
-                        elif c2 < image_width - 1 and pixel_array[c1][c2 + 1] != 0:
-                            queue.append((c1, c2 + 1))
-                            visited[c1] = [c2 + 1]
-                    elif c2 > 0 and c2 - 1 not in visited[c1] and pixel_array[c1][c2 - 1] != 0:
-                        queue.append((c1, c2 - 1))
-                        visited[c1].append(c2 - 1)
-                    elif c2 < image_width - 1 and c2 + 1 not in visited[c1] and pixel_array[c1][c2 + 1] != 0:
-                        queue.append((c1, c2 + 1))
-                        visited[c1].append(c2 + 1)
-
-                    if c1 > 0 and pixel_array[c1 - 1][c2] != 0:
-                        if c1 - 1 not in visited:
-                            queue.append((c1 - 1, c2))
-                            visited[c1 - 1] = [c2]
-                        elif c2 not in visited[c1 - 1]:
-                            queue.append((c1 - 1, c2))
-                            visited[c1 - 1].append(c2)
-                    if c1 < image_height - 1 and pixel_array[c1 + 1][c2] != 0:
-                        if c1 + 1 not in visited:
-                            queue.append((c1 + 1, c2))
-                            visited[c1 + 1] = [c2]
-                        elif c2 not in visited[c1 + 1]:
-                            queue.append((c1 + 1, c2))
-                            visited[c1 + 1].append(c2)
-                count += 1
-    return result, components
+        scanRow(distance[r], distance[r - 1] if r > 0 else outside_row, False)
+    for r in range(image_height - 1, -1, -1):
+        scanRow(distance[r], distance[r + 1] if r < image_height - 1 else outside_row, True)
+    return distance
+
+
+# the same result as iterations times computeDilation8Nbh3x3FlatSE, from a chessboard distance transform:
+# a pixel is in the dilation if some foreground pixel is within distance iterations.
+# The cost does not depend on iterations. Without any foreground pixel the distances are all the far value of
+# computeChessboardDistanceTransform, which a large enough iterations would reach, so that case is left empty
+def computeDilationByDistanceTransform(pixel_array, image_width, image_height, iterations):
+    if not numpy.any(pixel_array):
+        return numpy.zeros((image_height, image_width), dtype=numpy.uint8)
+    dilated_array = computeChessboardDistanceTransform(pixel_array, image_width, image_height) <= iterations
+    return dilated_array.astype(numpy.uint8)
+
+
+# the same result as iterations times computeErosion8Nbh3x3FlatSE, from a chessboard distance transform:
+# a pixel stays in the erosion if no background pixel, or pixel outside the image, is within distance iterations
+def computeErosionByDistanceTransform(pixel_array, image_width, image_height, iterations):
+    # surround the image with one ring of background
+    background = numpy.ones((image_height + 2, image_width + 2), dtype=numpy.uint8)
+    background[1:image_height + 1, 1:image_width + 1] = pixel_array == 0
+    distance = computeChessboardDistanceTransform(background, image_width + 2, image_height + 2)
+    eroded_array = distance[1:image_height + 1, 1:image_width + 1] > iterations
+    return eroded_array.astype(numpy.uint8)
+
+
+# closing with the same result as iterations times computeDilation8Nbh3x3FlatSE followed by
+# iterations times computeErosion8Nbh3x3FlatSE, from two chessboard distance transforms.
+# The cost does not depend on iterations
+def computeClosingByDistanceTransform(pixel_array, image_width, image_height, iterations):
+    dilated_array = computeDilationByDistanceTransform(pixel_array, image_width, image_height, iterations)
+    return computeErosionByDistanceTransform(dilated_array, image_width, image_height, iterations)
+
+
+# raise a ValueError unless closing_engine is one of CLOSING_ENGINES and can close with a
+# se_width x se_height structuring element
+def checkClosingEngine(closing_engine, se_width, se_height):
+    if closing_engine not in CLOSING_ENGINES:
+        raise ValueError("closing engine must be one of {}".format(", ".join(CLOSING_ENGINES)))
+    if se_width < 1 or se_height < 1 or se_width % 2 == 0 or se_height % 2 == 0:
+        raise ValueError("structuring element width and height must be odd and positive")
+    if closing_engine == 'distance' and se_width != se_height:
+        raise ValueError("the distance closing engine only takes square structuring elements")
+
+
+# the dilation of the closing of the thresholded threshold_mask (a PackedBinaryMask) with closing_engine,
+# a PackedBinaryMask again for the packed engine and a uint8 pixel array for the others
+def computeClosingDilation(threshold_mask, image_width, image_height, se_width, se_height, closing_engine):
+    if closing_engine == 'packed':
+        return threshold_mask.dilation(se_width, se_height)
+    pixel_array = threshold_mask.toPixelArray()
+    if closing_engine == 'rectangular':
+        return computeDilationRectangularFlatSE(pixel_array, image_width, image_height, se_width, se_height)
+    return computeDilationByDistanceTransform(pixel_array, image_width, image_height, se_width // 2)
+
+
+# the erosion of the closing, of the dilated_mask of computeClosingDilation with the same closing_engine
+def computeClosingErosion(dilated_mask, image_width, image_height, se_width, se_height, closing_engine):
+    if closing_engine == 'packed':
+        return dilated_mask.erosion(se_width, se_height)
+    if closing_engine == 'rectangular':
+        return computeErosionRectangularFlatSE(dilated_mask, image_width, image_height, se_width, se_height)
+    return computeErosionByDistanceTransform(dilated_mask, image_width, image_height, se_width // 2)
+
+
+# a binary image with one bit per pixel. rows[r] is a Python int whose bit c is the pixel in row r, column c,
+# so a whole row is shifted, ORed or ANDed at once, a machine word of pixels at a time
+class PackedBinaryMask:
+
+    def __init__(self, image_width, image_height, rows=None):
+        self.image_width = image_width
+        self.image_height = image_height
+        self.rows = rows if rows is not None else [0] * image_height
+        # the bits of a whole row
+        self.row_bits = (1 << image_width) - 1
+
+    # pack a pixel array, every nonzero pixel is set
+    @classmethod
+    def fromPixelArray(cls, pixel_array, image_width, image_height):
+        packed = numpy.packbits(pixel_array != 0, axis=1, bitorder='little')
+        rows = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+        return cls(image_width, image_height, rows)
+
+    # unpack to a uint8 pixel array of 0 and 1
+    def toPixelArray(self):
+        return self.unpackRows(self.rows, self.image_width)[:, :self.image_width]
+
+    # unpack a list of row ints with at least width bits each into a uint8 array, one column per bit
+    def unpackRows(self, rows, width):
+        row_bytes = (width + 7) // 8
+        packed = numpy.frombuffer(b''.join(row.to_bytes(row_bytes, 'little') for row in rows), dtype=numpy.uint8)
+        return numpy.unpackbits(packed.reshape(len(rows), row_bytes), axis=1, bitorder='little')
+
+    # combine every row with its neighbours up to window_size // 2 columns to either side, and every row with the
+    # rows up to window_size // 2 above and below, using function (operator.or_ or operator.and_).
+    # Windows grow by doubling, so a window of n pixels takes about log2(n) shifts. Outside the image is 0
+    def combineWindow(self, se_width, se_height, function):
+        if se_width < 1 or se_height < 1 or se_width % 2 == 0 or se_height % 2 == 0:
+            raise ValueError("structuring element width and height must be odd and positive")
+        half_width = se_width // 2
+        rows = []
+        for row in self.rows:
+            # pixel c of the result combines pixels c - half_width .. c + half_width
+            combined = row << half_width
+            span = 1
+            while span < se_width:
+                step = min(span, se_width - span)
+                combined = function(combined, combined >> step)
+                span += step
+            rows.append(combined & self.row_bits)
+
+        half_height = se_height // 2
+        # rows past the bottom are filled with 0 by the zip below
+        rows = [0] * half_height + rows
+        span = 1
+        while span < se_height:
+            step = min(span, se_height - span)
+            rows = [function(row, below) for row, below in zip(rows, rows[step:] + [0] * step)]
+            span += step
+        return PackedBinaryMask(self.image_width, self.image_height, rows[:self.image_height])
+
+    # dilation with a se_width x se_height flat rectangular structuring element (both odd)
+    def dilation(self, se_width=3, se_height=3):
+        return self.combineWindow(se_width, se_height, operator.or_)
+
+    # erosion with a se_width x se_height flat rectangular structuring element (both odd),
+    # pixels outside the image are background as in computeErosion8Nbh3x3FlatSE
+    def erosion(self, se_width=3, se_height=3):
+        return self.combineWindow(se_width, se_height, operator.and_)
+
+    def closing(self, se_width=3, se_height=3):
+        return self.dilation(se_width, se_height).erosion(se_width, se_height)
+
+    # the horizontal runs of set pixels, in the form of computeForegroundRuns
+    def computeRuns(self):
+        # a run starts at a set pixel after a clear one, and ends (exclusive) at a clear pixel after a set one
+        starts = [row & ~(row << 1) for row in self.rows]
+        ends = [(row << 1) & ~row for row in self.rows]
+        run_row, run_start = numpy.nonzero(self.unpackRows(starts, self.image_width + 1))
+        run_end = numpy.nonzero(self.unpackRows(ends, self.image_width + 1))[1]
+        row_first_run = numpy.searchsorted(run_row, numpy.arange(self.image_height + 1))
+        return run_row, run_start, run_end, row_first_run
+
+
+# compute a packed mask by threshold, set where anArray >= threshold (the 255 pixels of getThresholdArray)
+def getThresholdMask(anArray, image_width, image_height, threshold):
+    return PackedBinaryMask.fromPixelArray(anArray >= threshold, image_width, image_height)
+
+
+# find the horizontal runs of foreground pixels in every row, in raster order.
+# Returns numpy arrays run_row, run_start, run_end (exclusive) and row_first_run, where the runs of row r
+# are run_row[row_first_run[r]:row_first_run[r + 1]]
+def computeForegroundRuns(pixel_array, image_width, image_height):
+    if isinstance(pixel_array, PackedBinaryMask):
+        return pixel_array.computeRuns()
+    # pad each row with background so a run never continues into the next row
+    foreground = numpy.zeros((image_height, image_width + 2), dtype=numpy.int8)
+    foreground[:, 1:image_width + 1] = pixel_array != 0
+    edges = numpy.diff(foreground, axis=1)
+    run_row, run_start = numpy.nonzero(edges == 1)
+    run_end = numpy.nonzero(edges == -1)[1]
+    row_first_run = numpy.searchsorted(run_row, numpy.arange(image_height + 1))
+    return run_row, run_start, run_end, row_first_run
+
+
+# union-find root of a provisional label, with path halving
+def findRoot(parent, label):
+    while parent[label] != label:
+        parent[label] = parent[parent[label]]
+        label = parent[label]
+    return label
+
+
+# one entry per label in the statistics table of computeConnectedComponentLabeling (entry 0 is the background).
+# min/max x/y are the extents of the component; scan_min_x and scan_min_y are the minimums the original raster scan
+# bounding box search reported, where a pixel that raises the maximum never lowers the minimum, and the minimum
+# starts at the image size. perimeter counts the pixel edges between the component and the background or border
+COMPONENT_STATISTICS_DTYPE = numpy.dtype([
+    ('area', numpy.int64),
+    ('min_x', numpy.int64), ('min_y', numpy.int64),
+    ('max_x', numpy.int64), ('max_y', numpy.int64),
+    ('scan_min_x', numpy.int64), ('scan_min_y', numpy.int64),
+    ('centroid_x', numpy.float64), ('centroid_y', numpy.float64),
+    ('perimeter', numpy.int64),
+])
+
+
+# get connected components, two pass labeling with union-find over the runs of each row.
+# connectivity is 4 (left, right, up, down) or 8 (diagonals as well). Labels are numbered 1, 2, ...
+# in the raster order of each component's first pixel, and components maps every label to its area.
+# With statistics=True a third value is returned, a table of COMPONENT_STATISTICS_DTYPE indexed by label,
+# built from the runs while labeling so the pixels are not scanned again.
+# With label_image=False the label image is not painted and None is returned for it, so no full size array
+# is needed when only the components are
+def computeConnectedComponentLabeling(pixel_array, image_width, image_height, connectivity=4, statistics=False,
+                                      label_image=True):
+    if connectivity not in (4, 8):
+        raise ValueError("connectivity must be 4 or 8")
+    # with 8-connectivity runs that only touch at a corner are connected as well
+    reach = 0 if connectivity == 4 else 1
+
+    run_row, run_start, run_end, row_first_run = computeForegroundRuns(pixel_array, image_width, image_height)
+    rows = run_row.tolist()
+    starts = run_start.tolist()
+    ends = run_end.tolist()
+    first_run = row_first_run.tolist()
+    # number of pixels each run shares with the runs above it, for the perimeter
+    overlap = [0] * len(starts)
+
+    # first pass: give every run a provisional label, the label of the first run above it that it touches,
+    # and record that all other runs it touches are the same component. The root of a component is always
+    # its smallest label, which is the component's first run in raster order
+    parent = list(range(len(starts)))
+    for r in range(1, image_height):
+        above = first_run[r - 1]
+        above_end = first_run[r]
+        for run in range(first_run[r], first_run[r + 1]):
+            start = starts[run] - reach
+            end = ends[run] + reach
+            # runs above that end before this one starts cannot touch this run or any later one
+            while above < above_end and ends[above] <= start:
+                above += 1
+            other = above
+            while other < above_end and starts[other] < end:
+                overlap[run] += max(0, min(ends[run], ends[other]) - max(starts[run], starts[other]))
+                root = findRoot(parent, other)
+                own_root = findRoot(parent, run)
+                if root < own_root:
+                    parent[own_root] = root
+                elif own_root < root:
+                    parent[root] = own_root
+                other += 1
+
+    # second pass: resolve every run to its root and number the roots in order.
+    # The extents are updated run by run in raster order, like the original bounding box scan
+    labels = [0] * len(starts)
+    min_x = [image_width]
+    max_x = [0]
+    min_y = [image_height]
+    max_y = [0]
+    scan_min_x = [image_width]
+    scan_min_y = [image_height]
+    count = 0
+    for run in range(len(starts)):
+        root = findRoot(parent, run)
+        if root == run:
+            count += 1
+            label = count
+            min_x.append(image_width)
+            max_x.append(0)
+            min_y.append(image_height)
+            max_y.append(0)
+            scan_min_x.append(image_width)
+            scan_min_y.append(image_height)
+        else:
+            label = labels[root]
+        labels[run] = label
+        if statistics:
+            r = rows[run]
+            start = starts[run]
+            last = ends[run] - 1
+            # the pixels of a run up to the largest column seen so far do not raise the maximum
+            if start <= max_x[label] and start < scan_min_x[label]:
+                scan_min_x[label] = start
+            # the second pixel found in a row does not raise the row maximum
+            if (r <= max_y[label] or last > start) and r < scan_min_y[label]:
+                scan_min_y[label] = r
+            min_x[label] = min(min_x[label], start)
+            max_x[label] = max(max_x[label], last)
+            min_y[label] = min(min_y[label], r)
+            max_y[label] = max(max_y[label], r)
+    run_label = numpy.array(labels, dtype=numpy.uint32)
+
+    lengths = run_end - run_start
+    areas = numpy.bincount(run_label, weights=lengths, minlength=count + 1)
+    components = {label: int(areas[label]) for label in range(1, count + 1)}
+
+    result = None
+    if label_image:
+        # paint the labels, one entry per foreground pixel
+        result = createInitializedGreyscalePixelArray(image_width, image_height, 0, numpy.uint32)
+        pixel_run = numpy.repeat(numpy.arange(len(starts)), lengths)
+        run_offset = numpy.cumsum(lengths) - lengths
+        columns = numpy.arange(len(pixel_run)) - run_offset[pixel_run] + run_start[pixel_run]
+        result[run_row[pixel_run], columns] = run_label[pixel_run]
+    if not statistics:
+        return result, components
+
+    table = numpy.zeros(count + 1, dtype=COMPONENT_STATISTICS_DTYPE)
+    table['area'] = areas
+    table['min_x'] = min_x
+    table['max_x'] = max_x
+    table['min_y'] = min_y
+    table['max_y'] = max_y
+    table['scan_min_x'] = scan_min_x
+    table['scan_min_y'] = scan_min_y
+    # a run covers columns start .. end - 1, whose sum is (start + end - 1) * length / 2
+    column_sums = numpy.bincount(run_label, weights=(run_start + run_end - 1) * lengths / 2, minlength=count + 1)
+    row_sums = numpy.bincount(run_label, weights=run_row * lengths, minlength=count + 1)
+    # a run has 2 * length + 2 edges, less 2 for every pixel it shares with a run above
+    edges = 2 * lengths + 2 - 2 * numpy.array(overlap, dtype=numpy.int64)
+    table['perimeter'] = numpy.bincount(run_label, weights=edges, minlength=count + 1)
+    table['centroid_x'][1:] = column_sums[1:] / areas[1:]
+    table['centroid_y'][1:] = row_sums[1:] / areas[1:]
+    table[0] = 0
+    return result, components, table
+
+
+# find the biggest connected component whose bounding box has a width / height ratio between
+# min_ratio and max_ratio, using the statistics table from computeConnectedComponentLabeling.
+# The box is (scan_min_x, scan_min_y, max_x, max_y), as the original search reported it.
+# Returns (label, ratio), or (None, None) if no component qualifies
+def findLicencePlateComponent(component_statistics, min_ratio=1.5, max_ratio=5):
+    table = component_statistics[1:]
+    width = table['max_x'] - table['scan_min_x']
+    height = table['max_y'] - table['scan_min_y']
+    # boxes without height are rejected
+    ratio = width / numpy.where(height != 0, height, 1)
+    accepted = (height != 0) & (ratio >= min_ratio) & (ratio <= max_ratio)
+    # largest area first, smallest label first among equal areas
+    for index in numpy.argsort(-table['area'], kind='stable'):
+        if accepted[index]:
+            return int(index) + 1, float(ratio[index])
+    return None, None
+
+
+# rows a band needs above and below it for the 5 x 5 windows of getStandardDeviation
+STANDARD_DEVIATION_HALO = 2
+
+
+# the bands of at most band_height rows of an image, as (start, end) row ranges
+def computeBands(image_height, band_height):
+    if band_height < 1:
+        raise ValueError("band_height must be at least 1")
+    return [(start, min(start + band_height, image_height)) for start in range(0, image_height, band_height)]
+
+
+# getStandardDeviation of the stretched pixel_array, computed band by band. Each band is stretched with the
+# minimum and maximum of the whole image and its standard deviation computed together with the halo rows
+# above and below it, so the floating point stretch only ever covers one band (getStandardDeviation works
+# in strips of its own). The result, a full size uint8 image, is the same as for the whole image at once
+def getStretchedStandardDeviationInBands(pixel_array, image_width, image_height, band_height):
+    minimum = int(pixel_array.min())
+    maximum = int(pixel_array.max())
+    sd_array = createInitializedGreyscalePixelArray(image_width, image_height)
+    for (start, end) in computeBands(image_height, band_height):
+        top = max(0, start - STANDARD_DEVIATION_HALO)
+        bottom = min(image_height, end + STANDARD_DEVIATION_HALO)
+        band = stretchRange(pixel_array[top:bottom], minimum, maximum)
+        sd_band = getStandardDeviation(band, image_width, bottom - top)
+        sd_array[start:end] = sd_band[start - top:end - top]
+    return sd_array
+
+
+# stretch pixel_array in place band by band, calculate the adaptive threshold from the sum of the band
+# histograms, and threshold it into a packed mask band by band. Returns (threshold, threshold mask)
+def getThresholdMaskInBands(pixel_array, image_width, image_height, band_height):
+    minimum = int(pixel_array.min())
+    maximum = int(pixel_array.max())
+    bands = computeBands(image_height, band_height)
+    histogram = numpy.zeros(256)
+    for (start, end) in bands:
+        pixel_array[start:end] = stretchRange(pixel_array[start:end], minimum, maximum)
+        histogram += computeHistogram(pixel_array[start:end], image_width, end - start)
+    threshold = getThresholdFromHistogram(histogram)
+
+    rows = []
+    for (start, end) in bands:
+        rows.extend(getThresholdMask(pixel_array[start:end], image_width, end - start, threshold).rows)
+    return (threshold, PackedBinaryMask(image_width, image_height, rows))
 
 
 # License plate detection in this function follows structure given in recording,
 # but the step get high contrast region by computing standard deviation is done twice.
-# Adaptive thresholding is also used instead of a set threshold
+# Adaptive thresholding is also used instead of a set threshold.
+# Returns a dictionary with the adaptive threshold, the ratio and bounding box (min_x, min_y, max_x, max_y)
+# of the licence plate component, both None when no component has a licence plate ratio, and the timings,
+# the wall seconds of every stage recorded by recorder so far.
+# Every stage is recorded by recorder (a StageRecorder of CS373Instrumentation, by default one of its own),
+# and report (print, for example) is called with a progress message after every stage.
+# With band_height the stretches and the threshold run band by band with the same results, so only their
+# floating point temporaries are bounded by the band: the greyscale image, decoded in full before the detection,
+# both standard deviation images (uint8) and the bit-packed masks stay full size. The first stretch
+# is then part of standard_deviation_1.
+# The thresholded image is closed with a closing_width x closing_height structuring element by closing_engine,
+# one of CLOSING_ENGINES (see checkClosingEngine)
+def detectLicencePlate(greyscale_pixel_array, image_width, image_height, recorder=None, report=None,
+                       band_height=None, closing_engine='packed', closing_width=CLOSING_SE_WIDTH,
+                       closing_height=CLOSING_SE_HEIGHT):
+    checkClosingEngine(closing_engine, closing_width, closing_height)
+    if recorder is None:
+        recorder = StageRecorder()
+    if report is None:
+        def report(*message):
+            pass
+
+    if band_height is None:
+        with recorder.stage('stretch'):
+            stretched_array = stretch(greyscale_pixel_array, image_height, image_width)
+        report("stretch done")
+        # standard deviation done twice to get higher contrast
+        with recorder.stage('standard_deviation_1'):
+            sd_array = getStandardDeviation(stretched_array, image_width, image_height)
+            second_stretch = stretch(sd_array, image_height, image_width)
+        report("standard deviation once")
+        with recorder.stage('standard_deviation_2'):
+            sd_array = getStandardDeviation(second_stretch, image_width, image_height)
+            second_stretch = stretch(sd_array, image_height, image_width)
+        report("standard deviation twice")
+        # calculate adaptive threshold
+        with recorder.stage('threshold'):
+            threshold = getThreshold(second_stretch, image_height, image_width)
+            threshold_mask = getThresholdMask(second_stretch, image_width, image_height, threshold)
+        report("calculated adaptive threshold = ", threshold)
+    else:
+        # every stretch is applied band by band on the way into the next stage
+        with recorder.stage('standard_deviation_1'):
+            sd_array = getStretchedStandardDeviationInBands(greyscale_pixel_array, image_width, image_height,
+                                                            band_height)
+        report("standard deviation once")
+        with recorder.stage('standard_deviation_2'):
+            sd_array = getStretchedStandardDeviationInBands(sd_array, image_width, image_height, band_height)
+        report("standard deviation twice")
+        with recorder.stage('threshold'):
+            (threshold, threshold_mask) = getThresholdMaskInBands(sd_array, image_width, image_height, band_height)
+        report("calculated adaptive threshold = ", threshold)
+
+    # one dilation and erosion, by default 15 x 15, the same as 7 times 3 x 3 each, on the bit-packed mask
+    with recorder.stage('dilation'):
+        dilated_mask = computeClosingDilation(threshold_mask, image_width, image_height, closing_width,
+                                              closing_height, closing_engine)
+    report("dilation {} x {}".format(closing_width, closing_height))
+    with recorder.stage('erosion'):
+        eroded_mask = computeClosingErosion(dilated_mask, image_width, image_height, closing_width,
+                                            closing_height, closing_engine)
+    report("erosion {} x {}".format(closing_width, closing_height))
+
+    with recorder.stage('labeling'):
+        (connected_components, components_dictionary, component_statistics) = computeConnectedComponentLabeling(
+            eroded_mask, image_width, image_height, statistics=True, label_image=False)
+    report("connected components labeled")
+
+    result = {'threshold': int(threshold), 'ratio': None, 'bbox': None}
+    with recorder.stage('bbox'):
+        # find biggest connected component where ratio is < 5 and > 1.5
+        (plate_label, result['ratio']) = findLicencePlateComponent(component_statistics)
+        if plate_label is not None:
+            plate = component_statistics[plate_label]
+            result['bbox'] = (int(plate['scan_min_x']), int(plate['scan_min_y']),
+                              int(plate['max_x']), int(plate['max_y']))
+    result['timings'] = recorder.totals()
+    return result
+
+
+# draw the outline of bbox (min_x, min_y, max_x, max_y, all inclusive) into pixel_array in place,
+# line_width pixels thick on the inside of the box. pixel_array is greyscale (image_height, image_width) with
+# a single value as colour, or RGB (image_height, image_width, 3) with an (r, g, b) colour
+def drawBoundingBox(pixel_array, bbox, colour, line_width=1):
+    (min_x, min_y, max_x, max_y) = bbox
+    pixel_array[min_y:min(min_y + line_width, max_y + 1), min_x:max_x + 1] = colour
+    pixel_array[max(max_y + 1 - line_width, min_y):max_y + 1, min_x:max_x + 1] = colour
+    pixel_array[min_y:max_y + 1, min_x:min(min_x + line_width, max_x + 1)] = colour
+    pixel_array[min_y:max_y + 1, max(max_x + 1 - line_width, min_x):max_x + 1] = colour
+    return pixel_array
+
+
+# the output image of a detection, an RGB pixel array with the bounding box drawn in BOUNDING_BOX_COLOUR
+# into the input image, in colour when the r, g, b pixel arrays are given, in greyscale otherwise
+def createDetectionImage(greyscale_pixel_array, bbox, colour_pixel_arrays=None):
+    if colour_pixel_arrays is not None:
+        rgb = numpy.stack(colour_pixel_arrays, axis=2)
+    else:
+        rgb = numpy.repeat(greyscale_pixel_array[:, :, numpy.newaxis], 3, axis=2)
+    return drawBoundingBox(rgb, bbox, BOUNDING_BOX_COLOUR, BOUNDING_BOX_LINE_WIDTH)
+
+
+# write a uint8 greyscale (image_height, image_width) or RGB (image_height, image_width, 3) pixel array
+# into a png file with our png writer
+def writePixelArrayToPNG(output_filename, pixel_array):
+    (image_height, image_width) = pixel_array.shape[:2]
+    planes = 1 if pixel_array.ndim == 2 else pixel_array.shape[2]
+    image_writer = imageIO.png.Writer(image_width, image_height, greyscale=planes == 1)
+    rows = pixel_array.reshape(image_height, image_width * planes)
+    with open(output_filename, "wb") as output_file:
+        image_writer.write(output_file, (row.tobytes() for row in rows))
+
+
+# Detect the licence plate of one file for the batch mode, and write the output image into output_directory
+# if it is not None, on the colour input image with colour_output=True.
+# band_height and the closing arguments are passed on to detectLicencePlate, check_crc and threaded_decode
+# to readGreyscaleImageToPixelArray.
+# Returns the result of detectLicencePlate with the filename and image size added.
+# With trace_directory the stages and the png reader phases are written there as a Chrome trace,
+# and with memory=True the peak memory allocated in every stage is added to the result as well.
+# Any error is returned as the 'error' and 'error_type' of the result instead of raised, so one bad file does
+# not stop the batch
+def detectLicencePlateInFile(input_filename, output_directory=None, trace_directory=None, memory=False,
+                             colour_output=False, band_height=None, check_crc=True, threaded_decode=False,
+                             closing_engine='packed', closing_width=CLOSING_SE_WIDTH,
+                             closing_height=CLOSING_SE_HEIGHT):
+    result = {'filename': input_filename}
+    recorder = StageRecorder(memory)
+    try:
+        with recorder.stage('decode'):
+            (image_width, image_height, greyscale_pixel_array, colour_pixel_arrays) = readGreyscaleImageToPixelArray(
+                input_filename, colour_output and output_directory is not None, recorder if trace_directory else None,
+                check_crc, threaded_decode)
+        result['width'] = image_width
+        result['height'] = image_height
+        result.update(detectLicencePlate(greyscale_pixel_array, image_width, image_height, recorder,
+                                         band_height=band_height, closing_engine=closing_engine,
+                                         closing_width=closing_width, closing_height=closing_height))
+
+        if output_directory is not None and result['bbox'] is not None:
+            with recorder.stage('output'):
+                output_filename = Path(output_directory) / (Path(input_filename).stem + "_output.png")
+                writePixelArrayToPNG(output_filename, createDetectionImage(
+                    greyscale_pixel_array, result['bbox'], colour_pixel_arrays))
+            result['output_filename'] = str(output_filename)
+            result['timings'] = recorder.totals()
+    except Exception as e:
+        result['error_type'] = type(e).__name__
+        result['error'] = str(e)
+
+    if memory:
+        result['peak_memory'] = {name: entry['peak_memory'] for (category, name), entry in recorder.summary().items()
+                                 if category == 'pipeline'}
+    if trace_directory is not None:
+        recorder.writeChromeTrace(Path(trace_directory) / (Path(input_filename).stem + "_trace.json"))
+    return result
+
+
+# the png files named by the batch inputs, in order and without duplicates. An input is a directory
+# (all of its png files), a glob pattern ('**' matches any number of directories) or a filename
+def findBatchInputFiles(inputs):
+    input_filenames = []
+    for batch_input in inputs:
+        if os.path.isdir(batch_input):
+            filenames = sorted(str(path) for path in Path(batch_input).glob("*.png"))
+        elif glob.has_magic(batch_input):
+            filenames = sorted(glob.glob(batch_input, recursive=True))
+        else:
+            filenames = [batch_input]
+        input_filenames.extend(filenames)
+    return list(dict.fromkeys(input_filenames))
+
+
+# the number of pixels of a png file, from its header alone without decoding anything.
+# 0 for a file that cannot be probed, its error is reported when it is detected
+def probeImagePixels(input_filename):
+    try:
+        with open(input_filename, "rb") as input_file:
+            header = imageIO.png.Reader(file=input_file).probe()
+    except (OSError, imageIO.png.Error):
+        return 0
+    return header.width * header.height
+
+
+# add the options choosing the closing of the thresholded image to the command line parser
+def addClosingArguments(parser):
+    parser.add_argument("--closing-engine", choices=CLOSING_ENGINES, default='packed',
+                        help="how to close the thresholded image, all give the same result (default: packed)")
+    parser.add_argument("--closing-width", type=int, default=None,
+                        help="width of the closing structuring element, odd (default: {})".format(CLOSING_SE_WIDTH))
+    parser.add_argument("--closing-height", type=int, default=None,
+                        help="height of the closing structuring element, odd (default: {})".format(
+                            CLOSING_SE_HEIGHT))
+    parser.add_argument("--closing-iterations", type=int, default=None, metavar="K",
+                        help="close like K iterations of the 3 x 3 dilation and erosion, a 2K+1 square")
+
+
+# fill in closing_width and closing_height of the parsed arguments from the options of addClosingArguments,
+# and stop with a usage error for a closing that cannot be done
+def checkClosingArguments(parser, arguments):
+    if arguments.closing_iterations is not None:
+        if arguments.closing_width is not None or arguments.closing_height is not None:
+            parser.error("--closing-iterations does not go with --closing-width or --closing-height")
+        if arguments.closing_iterations < 1:
+            parser.error("--closing-iterations must be at least 1")
+        arguments.closing_width = arguments.closing_height = 2 * arguments.closing_iterations + 1
+    if arguments.closing_width is None:
+        arguments.closing_width = CLOSING_SE_WIDTH
+    if arguments.closing_height is None:
+        arguments.closing_height = CLOSING_SE_HEIGHT
+    try:
+        checkClosingEngine(arguments.closing_engine, arguments.closing_width, arguments.closing_height)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+# Run function(*arguments) for every (key, arguments) of tasks on a pool of jobs worker processes and yield
+# (key, future) for every task as soon as it is done, the future holding its result or its exception.
+# Only as many tasks as there are workers are handed to the pool at a time, so a task that has been handed over
+# is running. A worker that dies (a crash or out of memory) breaks the whole pool: then a new pool is started,
+# and the tasks that never started are handed to it as if nothing happened. The tasks that were running when
+# the pool broke are run again one at a time, so that only the task that really kills its worker is reported
+# with the BrokenProcessPool error. tasks is read lazily, prefetch tasks ahead of the pool
+def runInProcessPool(function, tasks, jobs, prefetch=0):
+    # imported here, the single file mode does not need the process pool machinery
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    tasks = iter(tasks)
+    # tasks read from tasks and not handed to the pool yet
+    ready = deque()
+    # tasks that were running next to others when the pool broke, to be run again alone
+    suspects = deque()
+    # (key, arguments) of every task handed to the pool, by future
+    running = {}
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        while True:
+            try:
+                # a task is taken off its queue only once it is handed over
+                if suspects:
+                    if not running:
+                        running[executor.submit(function, *suspects[0][1])] = suspects[0]
+                        suspects.popleft()
+                else:
+                    while len(running) < jobs:
+                        if not ready:
+                            task = next(tasks, None)
+                            if task is None:
+                                break
+                            ready.append(task)
+                        running[executor.submit(function, *ready[0][1])] = ready[0]
+                        ready.popleft()
+                broken_pool = False
+            except BrokenProcessPool:
+                # a worker died since the last wait
+                broken_pool = True
+            if not running and not broken_pool:
+                return
+
+            if not broken_pool:
+                while len(ready) < prefetch:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    ready.append(task)
+                (done, not_done) = wait(running, return_when=FIRST_COMPLETED)
+                if not any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                    for future in done:
+                        yield (running.pop(future)[0], future)
+                    continue
+
+            # the pool is broken, and every task still running fails with it
+            wait(running)
+            broken = []
+            for future in list(running):
+                task = running.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    broken.append((task, future))
+                else:
+                    yield (task[0], future)
+            if len(broken) == 1:
+                # it ran alone, no doubt which task killed its worker
+                ((task, future),) = broken
+                yield (task[0], future)
+            else:
+                suspects.extend(task for (task, future) in broken)
+            executor.shutdown(wait=True)
+            executor = ProcessPoolExecutor(max_workers=jobs)
+    finally:
+        executor.shutdown(wait=True)
+
+
+# Batch mode: detect licence plates in many files over a pool of worker processes, so the interpreter,
+# numpy starts only once per worker. The files are handed to the workers largest first, probed from their
+# headers, so no large file is left to start last and hold up the end of the batch. One JSON line per file
+# is written to stdout as soon as the file is done, so lines come in completion order. A worker that dies fails
+# only its own file, the pool is restarted for the others (see runInProcessPool). Returns 1 if any file
+# failed, 0 otherwise. With --shared-memory the files are decoded in this process instead and detected in
+# the workers on the decoded images in shared memory, see CS373SharedMemory
+def runBatch(command_line_arguments):
+    parser = argparse.ArgumentParser(prog="CS373LicensePlateDetection.py --batch",
+                                     description="Detect licence plates in many png files.")
+    parser.add_argument("inputs", nargs="+", help="png files, directories of png files or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes, 1 runs every file in this process (default: all CPUs)")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="write an output image with the bounding box for every file into this directory")
+    parser.add_argument("--colour-output", action="store_true",
+                        help="draw the bounding box into the colour image instead of the greyscale one")
+    parser.add_argument("--skip-crc", action="store_true",
+                        help="do not verify the png chunk checksums, for trusted files")
+    parser.add_argument("--threaded-decode", action="store_true",
+                        help="decompress the png data in a thread of its own, overlapped with the unfiltering")
+    parser.add_argument("--band-height", type=int, default=None,
+                        help="stretch and threshold the image in bands of this many rows, bounding their temporaries")
+    parser.add_argument("--trace-dir", default=None,
+                        help="write a Chrome trace of the stages and png reader phases of every file "
+                             "into this directory")
+    parser.add_argument("--memory", action="store_true",
+                        help="add the peak memory allocated in every stage to the results (tracemalloc, slower)")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="decode in this process and hand the images to the workers in shared memory")
+    addClosingArguments(parser)
+    arguments = parser.parse_args(command_line_arguments)
+    checkClosingArguments(parser, arguments)
+    if arguments.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if arguments.band_height is not None and arguments.band_height < 1:
+        parser.error("--band-height must be at least 1")
+    if arguments.shared_memory and (arguments.colour_output or arguments.trace_dir or arguments.memory):
+        parser.error("--shared-memory does not support --colour-output, --trace-dir or --memory")
+
+    input_filenames = findBatchInputFiles(arguments.inputs)
+    for directory in (arguments.output_dir, arguments.trace_dir):
+        if directory is not None:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+
+    failed = False
+    if arguments.jobs == 1 and not arguments.shared_memory:
+        results = (detectLicencePlateInFile(input_filename, arguments.output_dir, arguments.trace_dir,
+                                            arguments.memory, arguments.colour_output, arguments.band_height,
+                                            not arguments.skip_crc, arguments.threaded_decode,
+                                            arguments.closing_engine, arguments.closing_width,
+                                            arguments.closing_height)
+                   for input_filename in input_filenames)
+        for result in results:
+            failed |= 'error' in result
+            print(json.dumps(result), flush=True)
+        return int(failed)
+
+    # a stable sort, files of the same size stay in input order
+    input_filenames.sort(key=probeImagePixels, reverse=True)
+    if arguments.shared_memory:
+        # imported here, like the process pool, the other modes do not need shared memory
+        from CS373SharedMemory import runSharedMemoryBatch
+        return runSharedMemoryBatch(input_filenames, arguments.jobs, arguments.output_dir, arguments.band_height,
+                                    not arguments.skip_crc, arguments.threaded_decode, arguments.closing_engine,
+                                    arguments.closing_width, arguments.closing_height)
+    tasks = ((input_filename, (input_filename, arguments.output_dir, arguments.trace_dir, arguments.memory,
+                               arguments.colour_output, arguments.band_height, not arguments.skip_crc,
+                               arguments.threaded_decode, arguments.closing_engine, arguments.closing_width,
+                               arguments.closing_height))
+             for input_filename in input_filenames)
+    for input_filename, future in runInProcessPool(detectLicencePlateInFile, tasks, arguments.jobs):
+        try:
+            result = future.result()
+        except Exception as e:
+            # the worker itself died, a crash or out of memory, rather than an error in the detection
+            result = {'filename': input_filename, 'error_type': type(e).__name__, 'error': str(e)}
+        failed |= 'error' in result
+        print(json.dumps(result), flush=True)
+    return int(failed)
+
+
 def main():
     command_line_arguments = sys.argv[1:]
 
+    if command_line_arguments[:1] == ["--batch"]:
+        return runBatch(command_line_arguments[1:])
+
+    parser = argparse.ArgumentParser(description="Detect the licence plate in a png file. "
+                                                 "Run with --batch as the first argument for the batch mode.")
+    parser.add_argument("input_filename", nargs="?", default=None,
+                        help="png file (default: numberplate1.png, showing the debug figures)")
+    parser.add_argument("output_filename", nargs="?", default=None,
+                        help="output image (default: output_images/<input>_output.png)")
+    parser.add_argument("--no-output", action="store_true", help="only print the results, write no output image")
+    parser.add_argument("--colour-output", action="store_true",
+                        help="draw the bounding box into the colour image instead of the greyscale one")
+    parser.add_argument("--skip-crc", action="store_true",
+                        help="do not verify the png chunk checksums, for trusted files")
+    parser.add_argument("--threaded-decode", action="store_true",
+                        help="decompress the png data in a thread of its own, overlapped with the unfiltering")
+    parser.add_argument("--band-height", type=int, default=None,
+                        help="stretch and threshold the image in bands of this many rows, bounding their temporaries")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="write a Chrome trace of the stages and png reader phases to FILE")
+    parser.add_argument("--memory", action="store_true",
+                        help="record the peak memory allocated in every stage (tracemalloc, slower)")
+    parser.add_argument("--summary", action="store_true", help="print a table of the time spent in every stage")
+    addClosingArguments(parser)
+    arguments = parser.parse_args(command_line_arguments)
+    checkClosingArguments(parser, arguments)
+    if arguments.band_height is not None and arguments.band_height < 1:
+        parser.error("--band-height must be at least 1")
+
     SHOW_DEBUG_FIGURES = True
 
     # this is the default input image filename
     input_filename = "numberplate1.png"
 
-    if command_line_arguments != []:
-        input_filename = command_line_arguments[0]
+    if arguments.input_filename is not None:
+        input_filename = arguments.input_filename
         SHOW_DEBUG_FIGURES = False
 
+    # the stages are only recorded when asked for, otherwise nothing is
+    profiling = arguments.trace is not None or arguments.memory or arguments.summary
+    recorder = StageRecorder(arguments.memory) if profiling else NULL_RECORDER
+
     output_path = Path("output_images")
     if not output_path.exists():
         # create output directory
         output_path.mkdir(parents=True, exist_ok=True)
 
     output_filename = output_path / Path(input_filename.replace(".png", "_output.png"))
-    if len(command_line_arguments) == 2:
-        output_filename = Path(command_line_arguments[1])
-
-    # we read in the png file, and receive three pixel arrays for red, green and blue components, respectively
-    # each pixel array contains 8 bit integer values between 0 and 255 encoding the color values
-    (image_width, image_height, px_array_r, px_array_g, px_array_b) = readRGBImageToSeparatePixelArrays(input_filename)
-
-    # setup the plots for intermediate results in a figure
-    fig1, axs1 = pyplot.subplots(2, 2)
-    axs1[0, 0].set_title('Input red channel of image')
-    axs1[0, 0].imshow(px_array_r, cmap='gray')
-    axs1[0, 1].set_title('Input green channel of image')
-    axs1[0, 1].imshow(px_array_g, cmap='gray')
-    axs1[1, 0].set_title('Input blue channel of image')
-    axs1[1, 0].imshow(px_array_b, cmap='gray')
-
-    # STUDENT IMPLEMENTATION here
+    if arguments.output_filename is not None:
+        output_filename = Path(arguments.output_filename)
 
-    greyscale_pixel_array = getGreyScale(px_array_r, px_array_g, px_array_b, image_width, image_height)
+    # we read in the png file and receive the greyscale pixel array, converted while decoding.
+    # The pixel arrays for red, green and blue components are only kept for the debug figure and colour output
+    colour_planes = SHOW_DEBUG_FIGURES or (arguments.colour_output and not arguments.no_output)
+    with recorder.stage('decode'):
+        (image_width, image_height, greyscale_pixel_array, colour_pixel_arrays) = readGreyscaleImageToPixelArray(
+            input_filename, colour_planes, recorder if profiling else None, not arguments.skip_crc,
+            arguments.threaded_decode)
+    print("read image width={}, height={}".format(image_width, image_height))
     print("greyscale done")
-    stretched_array = stretch(greyscale_pixel_array, image_height, image_width)
-    print("stretch done")
-    # standard deviation done twice to get higher contrast
-    sd_array = getStandardDeviation(stretched_array, image_width, image_height)
-    second_stretch = stretch(sd_array, image_height, image_width)
-    print("standard deviation once")
-    sd_array = getStandardDeviation(second_stretch, image_width, image_height)
-    second_stretch = stretch(sd_array, image_height, image_width)
-    print("standard deviation twice")
-    # calculate adaptive threshold
-    threshold = getThreshold(second_stretch, image_height, image_width)
-    print("calculated adaptive threshold = ", threshold)
-    threshold_array = getThresholdArray(second_stretch, image_width, image_height, threshold)
-    print("threshold_array done")
-
-    dilated_array = computeDilation8Nbh3x3FlatSE(threshold_array, image_width, image_height)
-    for count in range(6):
-        dilated_array = computeDilation8Nbh3x3FlatSE(dilated_array, image_width, image_height)
-    print("dilation x 7")
-
-    eroded_array = computeErosion8Nbh3x3FlatSE(dilated_array, image_width, image_height)
-    for count in range(6):
-        eroded_array = computeErosion8Nbh3x3FlatSE(eroded_array, image_width, image_height)
-    print("erosion x 7")
-
-    connected_components, components_dictionary = computeConnectedComponentLabeling(eroded_array, image_width, image_height)
-    # find biggest connected component where ratio is < 5 and > 1.5
-    done = False
-    while not done:
-        max_key = max(components_dictionary, key=components_dictionary.get)
-        maxY = 0
-        minY = image_height
-        maxX = 0
-        minX = image_width
-        for r in range(image_height):
-            for c in range(image_width):
-                if connected_components[r][c] == max_key:
-                    if r > maxY:
-                        maxY = r
-                    elif r < minY:
-                        minY = r
-                    if c > maxX:
-                        maxX = c
-                    elif c < minX:
-                        minX = c
-        ratio = (maxX - minX) / (maxY - minY)
-        if ratio > 5 or ratio < 1.5:
-            components_dictionary[max_key] = 0
-        else:
-            done = True
-            print("ratio: ", ratio)
 
-    px_array = greyscale_pixel_array
+    # matplotlib is only used for the debug figures, and only imported for them: it takes longer to import
+    # than a small image takes to detect. setup the plots for intermediate results in a figure
+    if SHOW_DEBUG_FIGURES:
+        from matplotlib import pyplot
+        from matplotlib.patches import Rectangle
+
+        fig1, axs1 = pyplot.subplots(2, 2)
+        (px_array_r, px_array_g, px_array_b) = colour_pixel_arrays
+        axs1[0, 0].set_title('Input red channel of image')
+        axs1[0, 0].imshow(px_array_r, cmap='gray')
+        axs1[0, 1].set_title('Input green channel of image')
+        axs1[0, 1].imshow(px_array_g, cmap='gray')
+        axs1[1, 0].set_title('Input blue channel of image')
+        axs1[1, 0].imshow(px_array_b, cmap='gray')
 
-    bbox_min_x = minX
-    bbox_max_x = maxX
-    bbox_min_y = minY
-    bbox_max_y = maxY
+    # STUDENT IMPLEMENTATION here
 
-    # Draw a bounding box as a rectangle into the input image
-    # Final image of detection
-    axs1[1, 1].set_title('Final image of detection')
-    axs1[1, 1].imshow(px_array, cmap='gray')
-    rect = Rectangle((bbox_min_x, bbox_min_y), bbox_max_x - bbox_min_x, bbox_max_y - bbox_min_y, linewidth=1,
-                     edgecolor='g', facecolor='none')
-    axs1[1, 1].add_patch(rect)
+    result = detectLicencePlate(greyscale_pixel_array, image_width, image_height, recorder, report=print,
+                                band_height=arguments.band_height, closing_engine=arguments.closing_engine,
+                                closing_width=arguments.closing_width, closing_height=arguments.closing_height)
+    if result['bbox'] is None:
+        print("no connected component with a licence plate ratio found")
+    else:
+        print("ratio: ", result['ratio'])
 
-    # write the output image into output_filename, using the matplotlib savefig method
-    extent = axs1[1, 1].get_window_extent().transformed(fig1.dpi_scale_trans.inverted())
-    pyplot.savefig(output_filename, bbox_inches=extent, dpi=600)
+        # Final image of detection, the bounding box drawn straight into the pixels
+        if not arguments.no_output:
+            with recorder.stage('output'):
+                writePixelArrayToPNG(output_filename, createDetectionImage(
+                    greyscale_pixel_array, result['bbox'], colour_pixel_arrays if arguments.colour_output else None))
+
+    if arguments.summary:
+        print(recorder.formatSummary())
+    if arguments.trace is not None:
+        recorder.writeChromeTrace(arguments.trace)
+    if result['bbox'] is None:
+        return
 
     if SHOW_DEBUG_FIGURES:
+        # Draw a bounding box as a rectangle into the input image
+        (bbox_min_x, bbox_min_y, bbox_max_x, bbox_max_y) = result['bbox']
+        axs1[1, 1].set_title('Final image of detection')
+        axs1[1, 1].imshow(greyscale_pixel_array, cmap='gray')
+        rect = Rectangle((bbox_min_x, bbox_min_y), bbox_max_x - bbox_min_x, bbox_max_y - bbox_min_y, linewidth=1,
+                         edgecolor='g', facecolor='none')
+        axs1[1, 1].add_patch(rect)
+
         # plot the current figure
         pyplot.show()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import collections
+import json
+import sys
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy
+
+# import our basic, light-weight png reader library
+import imageIO.png
+
+import CS373LicensePlateDetection as detection
+from CS373Instrumentation import StageRecorder
+
+'''
+Shared memory handoff of decoded images between the processes of the batch mode (--batch --shared-memory).
+
+The main process decodes every image straight into a multiprocessing.shared_memory segment and hands the
+detection workers only a small SharedArrayHandle (name, shape, dtype), so no pixels are pickled through the
+pipes of the process pool. A worker attaches to the segment, runs the detection on a numpy view of it without
+copying, and returns the small result dictionary. Decoding the next images on the main process overlaps with
+the detection of the earlier ones on the workers, and at most two images per worker are decoded ahead, so
+the shared memory in use stays bounded.
+
+Every segment is created and owned by a SharedArrayRegistry in the main process, which unlinks it as soon
+as its image is done, and unlinks all segments that are left when the batch ends, also when the batch was
+interrupted. A worker that dies fails only its own image: the pool is restarted and the other images are
+detected on it from the segments they are in already (see runInProcessPool). Workers only ever close their
+own mapping. Should the main process itself be killed, the resource tracker of multiprocessing unlinks the
+segments it leaves.
+'''
+
+# a shared array: the name of its shared memory segment, its shape and its numpy dtype as a string.
+# Pickled to the workers instead of the array
+SharedArrayHandle = collections.namedtuple('SharedArrayHandle', ['name', 'shape', 'dtype'])
+
+# images decoded ahead per worker process
+DECODE_AHEAD_PER_WORKER = 2
+
+
+# attach to the shared array of handle. Returns the segment, to be closed when done, and a numpy view of it.
+# The view has to be deleted before the segment is closed
+def attachSharedArray(handle):
+    segment = shared_memory.SharedMemory(name=handle.name)
+    pixel_array = numpy.ndarray(handle.shape, dtype=handle.dtype, buffer=segment.buf)
+    return (segment, pixel_array)
+
+
+# The owner of the shared arrays of the main process: creates them, and closes and unlinks them
+# when they are released, or at the latest when the registry is closed (at the end of its with block)
+class SharedArrayRegistry:
+
+    def __init__(self):
+        # segment and numpy view of every shared array not yet released, by segment name
+        self.segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # create a shared array of shape and dtype. Returns its handle
+    def create(self, shape, dtype):
+        dtype = numpy.dtype(dtype)
+        size = max(1, int(numpy.prod(shape)) * dtype.itemsize)
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        pixel_array = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        self.segments[segment.name] = (segment, pixel_array)
+        return SharedArrayHandle(segment.name, tuple(shape), dtype.str)
+
+    # the numpy view of the shared array of handle, not to be kept beyond its release
+    def array(self, handle):
+        return self.segments[handle.name][1]
+
+    # close and unlink the shared array of handle. Views of it must not be used afterwards
+    def release(self, handle):
+        (segment, pixel_array) = self.segments.pop(handle.name)
+        del pixel_array
+        segment.close()
+        segment.unlink()
+
+    # release every shared array that is left
+    def close(self):
+        for name in list(self.segments):
+            (segment, pixel_array) = self.segments[name]
+            self.release(SharedArrayHandle(name, pixel_array.shape, pixel_array.dtype.str))
+
+
+# decode a png file into a new greyscale shared array of registry, converting every row as soon as it is
+# decoded, like readGreyscaleImageToPixelArray. The size comes from the png header, so the decoded rows go
+# straight into the shared memory. Returns the handle of the shared array, which is released again if the
+# decoding fails
+def readGreyscaleImageToSharedArray(input_filename, registry, check_crc=True, threaded=False):
+    image_reader = imageIO.png.Reader(filename=input_filename, mmap=True, check_crc=check_crc, threaded=threaded)
+    header = image_reader.probe()
+    handle = registry.create((header.height, header.width), numpy.uint8)
+    greyscale_pixel_array = registry.array(handle)
+    try:
+        (image_width, image_height, image_rows, image_info) = image_reader.asLuminance8()
+        for r, row in enumerate(image_rows):
+            greyscale_pixel_array[r] = numpy.frombuffer(row, dtype=numpy.uint8)
+    except Exception:
+        # a file that fails half way through decoding does not keep its segment until the end of the batch
+        del greyscale_pixel_array
+        registry.release(handle)
+        raise
+    return handle
+
+
+# the worker side: detect the licence plate in the greyscale shared array of handle, in place.
+# Returns the result of detectLicencePlate, which takes the other arguments
+def detectLicencePlateInSharedArray(handle, band_height=None, closing_engine='packed',
+                                    closing_width=detection.CLOSING_SE_WIDTH,
+                                    closing_height=detection.CLOSING_SE_HEIGHT):
+    (segment, greyscale_pixel_array) = attachSharedArray(handle)
+    try:
+        (image_height, image_width) = handle.shape
+        return detection.detectLicencePlate(greyscale_pixel_array, image_width, image_height,
+                                            band_height=band_height, closing_engine=closing_engine,
+                                            closing_width=closing_width, closing_height=closing_height)
+    finally:
+        del greyscale_pixel_array
+        segment.close()
+
+
+# Batch mode over shared memory (see the module description): decode input_filenames on this process and
+# detect on jobs worker processes, with runInProcessPool, so a worker that dies fails only its own image.
+# Writes one JSON line per file to stdout as soon as the file is done, and the greyscale output image into
+# output_directory if it is not None. Returns 1 if any file failed, 0 otherwise
+def runSharedMemoryBatch(input_filenames, jobs, output_directory=None, band_height=None, check_crc=True,
+                         threaded_decode=False, closing_engine='packed', closing_width=detection.CLOSING_SE_WIDTH,
+                         closing_height=detection.CLOSING_SE_HEIGHT):
+    failed = False
+
+    def report(result):
+        nonlocal failed
+        failed |= 'error' in result
+        print(json.dumps(result), flush=True)
+
+    # the decoded images as tasks of runInProcessPool, the key of each is its result so far and its handle.
+    # Read by runInProcessPool while the workers detect
+    def decodedImages():
+        for input_filename in input_filenames:
+            result = {'filename': input_filename}
+            recorder = StageRecorder()
+            try:
+                with recorder.stage('decode'):
+                    handle = readGreyscaleImageToSharedArray(input_filename, registry, check_crc, threaded_decode)
+            except Exception as e:
+                result['error_type'] = type(e).__name__
+                result['error'] = str(e)
+                report(result)
+                continue
+            (result['height'], result['width']) = handle.shape
+            result['timings'] = recorder.totals()
+            yield ((result, handle), (handle, band_height, closing_engine, closing_width, closing_height))
+
+    with SharedArrayRegistry() as registry:
+        # the images being detected and the ones decoded ahead
+        prefetch = jobs * (DECODE_AHEAD_PER_WORKER - 1)
+        for (result, handle), future in detection.runInProcessPool(detectLicencePlateInSharedArray,
+                                                                   decodedImages(), jobs, prefetch):
+            try:
+                decode_timings = result.pop('timings')
+                result.update(future.result())
+                result['timings'] = dict(decode_timings, **result['timings'])
+                if output_directory is not None and result['bbox'] is not None:
+                    output_filename = Path(output_directory) / (Path(result['filename']).stem + "_output.png")
+                    detection.writePixelArrayToPNG(output_filename, detection.createDetectionImage(
+                        registry.array(handle), result['bbox']))
+                    result['output_filename'] = str(output_filename)
+            except Exception as e:
+                # an error in the detection, or the worker itself died
+                result['error_type'] = type(e).__name__
+                result['error'] = str(e)
+            finally:
+                registry.release(handle)
+            report(result)
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(detection.runBatch(["--shared-memory"] + sys.argv[1:]))